@@ -3,23 +3,46 @@ Flask application for managing a vinyl collection.
 Provides routes for user authentication, album management, and reviews.
 """
 
+import io
+import json
+import shutil
 import sqlite3
 import secrets
-from flask import Flask, render_template, request, redirect, session, flash, abort, g
+import tempfile
+from flask import (
+    Flask, Response, render_template, request, redirect, session, flash, abort, jsonify,
+    stream_with_context, url_for
+)
 from werkzeug.security import generate_password_hash, check_password_hash
+import assets
 import config
 import db
 import database
-import time
+import exporter
+import images
+import importer
+import metrics
+import pagecache
+import writes
+
+# Numbered page links use OFFSET, so they are only offered, and ?page= only
+# honoured, for shallow pages; deeper pages are reached through the keyset
+# Previous/Next cursors.
+MAX_NUMBERED_PAGES = 50
 
 app = Flask(__name__)
 app.secret_key = config.secret_key
+db.init_app(app)
+metrics.init_app(app)
+images.init_app(app)
+assets.init_app(app)
+metrics.register_collector(pagecache.render_metrics)
 
 def check_csrf():
     """
     Verifies the CSRF token in the request matches the session token.
     """
-    token = request.form.get("csrf_token")
+    token = request.form.get("csrf_token") or request.headers.get("X-CSRF-Token")
     if not token or token != session.get("csrf_token"):
         abort(403)
 
@@ -52,7 +75,7 @@ def register():
         password_hash = generate_password_hash(password1)
 
         try:
-            db.execute(
+            writes.execute(
                 "INSERT INTO users (username, password_hash) VALUES (?, ?)",
                 (username, password_hash)
             )
@@ -113,45 +136,53 @@ def logout():
     return redirect("/")
 
 @app.route("/", methods=["GET"])
+@pagecache.cached_page
 def index():
     """
     Displays the home page with a list of albums.
     """
     query_text = request.args.get("query", "").strip()
     user_id = session.get("user_id")
-    page = request.args.get("page", 1, type=int)
+    page = min(max(request.args.get("page", 1, type=int), 1), MAX_NUMBERED_PAGES)
     sort = request.args.get("sort", "newest")
+    cursor = request.args.get("cursor")
     per_page = 20
+    filters = database.make_filters(
+        request.args.getlist("genre", type=int),
+        request.args.get("year_from", type=int),
+        request.args.get("year_to", type=int)
+    )
+    facets = database.get_album_facets(filters)
 
-    albums, total_albums = (
-        database.search_albums(query_text, user_id, page, per_page, sort)
+    albums, total_albums, cursors = (
+        database.search_albums(query_text, user_id, page, per_page, sort, cursor, filters=filters)
         if query_text
-        else database.get_all_albums(user_id, page, per_page, sort)
+        else database.get_all_albums(
+            user_id, page, per_page, sort, cursor, filters=filters, facets=facets
+        )
     )
 
     total_pages = (total_albums + per_page - 1) // per_page
-
-    if user_id:
-        favorites = db.query(
-            "SELECT album_id FROM favorites WHERE user_id = ?",
-            (user_id,)
-        )
-        favorite_ids = [f["album_id"] for f in favorites]
-        for album in albums:
-            album["is_favorite"] = album["id"] in favorite_ids
-            album["user_id"] = album.get("user_id")
-            album["avg_stars"] = database.get_album_avg_rating(album["id"])
-    else:
-        for album in albums:
-            album["avg_stars"] = database.get_album_avg_rating(album["id"])
+    last_numbered_page = min(total_pages, MAX_NUMBERED_PAGES)
 
     return render_template(
         "index.html",
         albums=albums,
         query=query_text,
-        page=page,
+        total_albums=total_albums,
+        count_cap=database.SEARCH_COUNT_CAP,
+        page=None if cursor else page,
         total_pages=total_pages,
-        sort=sort
+        last_numbered_page=last_numbered_page,
+        cursors=cursors,
+        sort=sort,
+        filters=filters,
+        filter_args={
+            "genre": list(filters["genre_ids"]),
+            "year_from": filters["year_from"],
+            "year_to": filters["year_to"],
+        } if filters else {},
+        facets=facets
     )
 
 @app.route("/add", methods=["GET", "POST"])
@@ -182,6 +213,12 @@ def add():
         selected_genre_ids = form_data["genres"]
 
         errors = database.validate_album_data(form_data)
+        try:
+            form_data["image_url"] = (
+                images.save_upload(request.files.get("image_file")) or form_data["image_url"]
+            )
+        except images.InvalidImage as error:
+            errors["image_file"] = str(error)
 
         if errors:
             return render_template(
@@ -249,7 +286,7 @@ def delete_album(album_id):
         flash("You are not allowed to delete this album", "error")
         return redirect("/")
 
-    db.execute("DELETE FROM albums WHERE id = ?", (album_id,))
+    writes.execute("DELETE FROM albums WHERE id = ?", (album_id,))
     flash("Album deleted successfully", "success")
     return redirect("/")
 
@@ -290,6 +327,12 @@ def edit_album(album_id):
         selected_genre_ids = form_data["genres"]
 
         errors = database.validate_album_data(form_data)
+        try:
+            form_data["image_url"] = (
+                images.save_upload(request.files.get("image_file")) or form_data["image_url"]
+            )
+        except images.InvalidImage as error:
+            errors["image_file"] = str(error)
 
         if errors:
             return render_template(
@@ -336,77 +379,171 @@ def favorite(album_id):
 
     check_csrf()
 
-    user_id = session["user_id"]
-    existing = db.query(
-        "SELECT 1 FROM favorites WHERE user_id = ? AND album_id = ?",
-        (user_id, album_id)
+    favorited = database.toggle_favorite(session["user_id"], album_id)
+    if favorited is None:
+        flash("Album not found", "error")
+    elif favorited:
+        flash("Album added to favorites", "success")
+    else:
+        flash("Album removed from favorites", "success")
+
+    return redirect("/")
+
+@app.route("/api/favorites", methods=["POST"])
+def favorites_batch():
+    """
+    Applies a batch of favorite changes sent as JSON, e.g.
+    {"changes": [{"album_id": 1, "favorite": true}, ...]}, in one transaction
+    and returns the ids of all albums the user has favorited afterwards.
+    Later changes to the same album override earlier ones.
+    """
+    if "user_id" not in session:
+        return jsonify(error="You must be logged in to favorite albums"), 401
+
+    check_csrf()
+
+    payload = request.get_json(silent=True)
+    changes = payload.get("changes") if isinstance(payload, dict) else None
+    if not isinstance(changes, list) or len(changes) > database.FAVORITE_BATCH_LIMIT:
+        return jsonify(
+            error=f"Expected a list of at most {database.FAVORITE_BATCH_LIMIT} changes"
+        ), 400
+
+    favorite_changes = {}
+    for change in changes:
+        album_id = change.get("album_id") if isinstance(change, dict) else None
+        favorite = change.get("favorite") if isinstance(change, dict) else None
+        if not isinstance(album_id, int) or isinstance(album_id, bool) \
+                or not isinstance(favorite, bool):
+            return jsonify(
+                error="Each change needs an integer album_id and a boolean favorite"
+            ), 400
+        favorite_changes[album_id] = favorite
+
+    favorites = database.apply_favorite_changes(session["user_id"], favorite_changes)
+    return jsonify(favorites=favorites)
+
+@app.route("/api/autocomplete")
+def autocomplete():
+    """
+    Returns title and artist suggestions for the search box as JSON, e.g.
+    /api/autocomplete?q=dark+si&limit=5, ranked by number of reviews.
+    """
+    prefix = request.args.get("q", "")[:100]
+    limit = min(max(request.args.get("limit", database.AUTOCOMPLETE_LIMIT, type=int), 1),
+                database.AUTOCOMPLETE_MAX_LIMIT)
+    suggestions = database.get_suggestions(prefix, limit)
+    response = jsonify(
+        query=prefix,
+        titles=[
+            dict(title, url=url_for("album_detail", album_id=title["id"]))
+            for title in suggestions["titles"]
+        ],
+        artists=[
+            dict(artist, url=url_for("artist_page", artist_id=artist["id"]))
+            for artist in suggestions["artists"]
+        ]
     )
+    response.cache_control.public = True
+    response.cache_control.max_age = database.AUTOCOMPLETE_TTL
+    return response
 
-    if existing:
-        db.execute(
-            "DELETE FROM favorites WHERE user_id = ? AND album_id = ?",
-            (user_id, album_id)
-        )
-        flash("Album removed from favorites", "success")
+@app.route("/api/import", methods=["POST"])
+def import_collection():
+    """
+    Imports albums from an uploaded CSV or NDJSON file (form field "file")
+    into the logged-in user's collection. Progress is streamed back as one
+    JSON object per line after every chunk of rows.
+    """
+    if "user_id" not in session:
+        return jsonify(error="You must be logged in to import albums"), 401
+
+    check_csrf()
+
+    upload = request.files.get("file")
+    if not upload:
+        return jsonify(error="Upload a CSV or NDJSON file in the 'file' field"), 400
+    file_format = request.form.get("format") or importer.detect_format(upload.filename or "")
+    if file_format not in importer.FORMATS:
+        return jsonify(error=f"Format must be one of: {', '.join(importer.FORMATS)}"), 400
+
+    # Flask closes uploaded files when the view returns, before the streamed
+    # response is consumed, so the import reads from its own copy.
+    upload_copy = tempfile.TemporaryFile()
+    shutil.copyfileobj(upload.stream, upload_copy)
+    upload_copy.seek(0)
+    user_id = session["user_id"]
+
+    def generate():
+        with io.TextIOWrapper(upload_copy, encoding="utf-8-sig", newline="") as stream:
+            for progress in importer.import_albums(stream, file_format, user_id):
+                yield json.dumps(progress) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+@app.route("/export/<name>")
+def export(name):
+    """
+    Streams the logged-in user's albums, favorites or reviews as CSV or
+    NDJSON (?format=). The full catalog dump is only served to local clients.
+    """
+    file_format = request.args.get("format", "csv")
+    if name not in exporter.EXPORTS or file_format not in exporter.FORMATS:
+        abort(404)
+
+    user_id = None
+    if name == "catalog":
+        if request.remote_addr not in metrics.LOCAL_ADDRESSES:
+            abort(404)
+    elif "user_id" not in session:
+        flash("You must be logged in to export your data", "error")
+        return redirect("/login")
     else:
-        db.execute(
-            "INSERT INTO favorites (user_id, album_id) VALUES (?, ?)",
-            (user_id, album_id)
-        )
-        flash("Album added to favorites", "success")
+        user_id = session["user_id"]
 
-    return redirect("/")
+    return Response(
+        exporter.generate(name, file_format, user_id),
+        mimetype=exporter.MIMETYPES[file_format],
+        headers={"Content-Disposition": f'attachment; filename="{name}.{file_format}"'}
+    )
 
 @app.route("/user/<username>")
+@pagecache.cached_page
 def user_page(username):
     """
     Displays a user's profile page with their albums and statistics.
     """
-    user = db.query("SELECT id FROM users WHERE username = ?", (username,))
-    if not user:
+    page = min(max(request.args.get("page", 1, type=int), 1), MAX_NUMBERED_PAGES)
+    profile_user_id = database.get_user_id(username)
+    user_page_data = None
+    if profile_user_id:
+        user_page_data = database.get_user_page(profile_user_id, session.get("user_id"), page)
+    if not user_page_data:
         flash("User not found", "error")
         return redirect("/")
 
-    profile_user_id = user[0]["id"]
-    profile = database.get_user_profile(profile_user_id)
-    albums = database.get_user_albums(profile_user_id) or []
-    stats = database.get_user_stats(profile_user_id)
-    activity = database.get_user_activity(profile_user_id)
-
-    user_review_count = db.query(
-        "SELECT COUNT(*) as count FROM reviews WHERE user_id = ?",
-        (profile_user_id,)
-    )[0]['count']
-
-    current_user_id = session.get("user_id")
-    user_favorites = []
-    if current_user_id:
-        favorites = db.query(
-            "SELECT album_id FROM favorites WHERE user_id = ?",
-            (current_user_id,)
-        )
-        user_favorites = [f["album_id"] for f in favorites]
-
-    for album in albums:
-        album["is_favorite"] = album["id"] in user_favorites
-
-    user_favorites_albums = database.get_user_favorites(current_user_id) if current_user_id else []
-    if user_favorites_albums:
-        album_ids = [album["id"] for album in albums]
-        for album in user_favorites_albums:
-            if album["id"] not in album_ids:
-                albums.append(album)
-
     return render_template(
         "user.html",
-        albums=albums,
         username=username,
-        profile=profile,
-        user_favorites=user_favorites,
-        stats=stats,
-        activity=activity,
-        user_review_count=user_review_count
+        last_numbered_page=min(user_page_data["total_pages"], MAX_NUMBERED_PAGES),
+        **user_page_data
+    )
+
+@app.route("/artist/<int:artist_id>")
+@pagecache.cached_page
+def artist_page(artist_id):
+    """
+    Displays an artist's page with their statistics and albums, newest
+    release first.
+    """
+    artist_page_data = database.get_artist_page(
+        artist_id, session.get("user_id"), request.args.get("cursor")
     )
+    if not artist_page_data:
+        flash("Artist not found", "error")
+        return redirect("/")
+
+    return render_template("artist.html", **artist_page_data)
 
 @app.route("/profile/edit", methods=["GET", "POST"])
 def edit_profile():
@@ -431,6 +568,14 @@ def edit_profile():
 
         favorite_genre_id = int(favorite_genre) if favorite_genre and favorite_genre.isdigit() else None
 
+        try:
+            profile_image_url = (
+                images.save_upload(request.files.get("profile_image_file")) or profile_image_url
+            )
+        except images.InvalidImage as error:
+            flash(str(error), "error")
+            return render_template("edit_profile.html", profile=profile, genres=genres)
+
         database.update_user_profile(user_id, bio, location, profile_image_url, favorite_genre_id)
 
         flash("Profile updated successfully!", "success")
@@ -438,7 +583,21 @@ def edit_profile():
 
     return render_template("edit_profile.html", profile=profile, genres=genres)
 
+@app.route("/charts", defaults={"kind": "all", "scope": 0})
+@app.route("/charts/trending", defaults={"kind": "trending", "scope": 0})
+@app.route("/charts/<any(genre, decade):kind>/<int:scope>")
+@pagecache.cached_page
+def charts(kind, scope):
+    """
+    Displays a precomputed top chart: all time, trending, a genre or a decade.
+    """
+    chart = database.get_chart(kind, scope)
+    if not chart and kind != "all":
+        abort(404)
+    return render_template("charts.html", chart=chart, charts=database.get_charts())
+
 @app.route("/album/<int:album_id>")
+@pagecache.cached_page
 def album_detail(album_id):
     """
     Displays details for a specific album, including reviews and average rating.
@@ -449,7 +608,7 @@ def album_detail(album_id):
         return redirect("/")
 
     reviews = database.get_album_reviews(album_id)
-    avg_stars = database.get_album_avg_rating(album_id)
+    similar_albums = database.get_similar_albums(album_id)
 
     user_id = session.get("user_id")
     has_reviewed = database.has_user_reviewed(album_id, user_id) if user_id else False
@@ -458,8 +617,9 @@ def album_detail(album_id):
         "album.html",
         album=album,
         reviews=reviews,
-        avg_stars=avg_stars,
-        has_reviewed=has_reviewed
+        avg_stars=album['avg_stars'],
+        has_reviewed=has_reviewed,
+        similar_albums=similar_albums
     )
 
 @app.route("/review/<int:album_id>", methods=["POST"])
@@ -481,7 +641,7 @@ def add_review(album_id):
         return redirect(f"/album/{album_id}")
 
     try:
-        db.execute(
+        writes.execute(
             "INSERT INTO reviews (album_id, user_id, stars, text) VALUES (?, ?, ?, ?)",
             (album_id, session["user_id"], stars, text)
         )
@@ -491,15 +651,5 @@ def add_review(album_id):
 
     return redirect(f"/album/{album_id}")
 
-@app.before_request
-def before_request():
-    g.start_time = time.time()
-
-@app.after_request
-def after_request(response):
-    elapsed_time = round(time.time() - g.start_time, 2)
-    print("elapsed time:", elapsed_time, "s")
-    return response
-
 if __name__ == "__main__":
     app.run(debug=True)
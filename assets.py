@@ -0,0 +1,171 @@
+"""
+Fingerprinted static assets and compressed responses.
+
+Running this module copies every file in static/ to static/dist/ with a
+content hash in its name, writes gzip and (if the brotli package is
+installed) brotli versions of text assets next to them, and records the
+mapping in static/dist/manifest.json. Templates link assets through
+asset_url(), so the hashed files can be cached forever; files missing from
+the manifest fall back to the plain static URL.
+
+HTML responses above GZIP_MIN_BYTES are gzipped on the fly for clients that
+accept it.
+
+Usage:
+    python3 assets.py
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+from flask import abort, request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:  # brotli is optional
+    brotli = None
+
+SOURCE_DIR = "static"
+DIST_DIR = os.path.join(SOURCE_DIR, "dist")
+MANIFEST_NAME = "manifest.json"
+URL_PREFIX = "/assets/"
+COMPRESSIBLE = (".css", ".js", ".svg", ".txt", ".json", ".html")
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+CACHE_SECONDS = 365 * 24 * 60 * 60
+
+# Precompressed variants, in order of preference.
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+_manifest = {}
+_served_dir = None
+
+def fingerprint(path):
+    """
+    Returns the file name with the first 12 hex digits of its SHA-256 added.
+    """
+    with open(path, "rb") as source:
+        digest = hashlib.sha256(source.read()).hexdigest()[:12]
+    stem, extension = os.path.splitext(os.path.basename(path))
+    return f"{stem}.{digest}{extension}"
+
+def build(source_dir=SOURCE_DIR, dist_dir=DIST_DIR):
+    """
+    Writes fingerprinted and precompressed copies of the static files and
+    their manifest, removing outputs of earlier builds.
+    """
+    if os.path.isdir(dist_dir):
+        shutil.rmtree(dist_dir)
+    os.makedirs(dist_dir)
+    manifest = {}
+    for root, _, files in os.walk(source_dir):
+        if os.path.abspath(root).startswith(os.path.abspath(dist_dir)):
+            continue
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, source_dir).replace(os.sep, "/")
+            hashed = fingerprint(path)
+            output = os.path.join(dist_dir, hashed)
+            shutil.copyfile(path, output)
+            manifest[relative] = hashed
+            if name.endswith(COMPRESSIBLE):
+                with open(path, "rb") as source:
+                    data = source.read()
+                with open(output + ".gz", "wb") as compressed:
+                    compressed.write(gzip.compress(data, 9, mtime=0))
+                if brotli is not None:
+                    with open(output + ".br", "wb") as compressed:
+                        compressed.write(brotli.compress(data))
+    with open(os.path.join(dist_dir, MANIFEST_NAME), "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    return manifest
+
+def load_manifest(dist_dir):
+    path = os.path.join(dist_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as manifest_file:
+        return json.load(manifest_file)
+
+def asset_url(filename):
+    """
+    Template helper returning the fingerprinted URL of a static file.
+    """
+    hashed = _manifest.get(filename)
+    if hashed is None:
+        return url_for("static", filename=filename)
+    return URL_PREFIX + hashed
+
+def asset_view(name):
+    """
+    Serves a fingerprinted file, picking a precompressed variant the client
+    accepts.
+    """
+    if name not in _manifest.values():
+        abort(404)
+    encoding = None
+    for candidate, suffix in ENCODINGS:
+        if request.accept_encodings[candidate] and os.path.exists(
+                os.path.join(_served_dir, name + suffix)):
+            encoding = candidate
+            name_on_disk = name + suffix
+            break
+    else:
+        name_on_disk = name
+
+    response = send_from_directory(
+        _served_dir, name_on_disk, max_age=CACHE_SECONDS,
+        mimetype=mimetypes.guess_type(name)[0] or "application/octet-stream"
+    )
+    # The file on disk may be the .br/.gz variant; don't advertise its name.
+    response.headers.pop("Content-Disposition", None)
+    if encoding:
+        response.content_encoding = encoding
+    response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+def compress_response(response):
+    """
+    Gzips HTML responses above GZIP_MIN_BYTES for clients that accept gzip.
+    """
+    if (response.mimetype != "text/html"
+            or response.status_code != 200
+            or response.direct_passthrough
+            or response.is_streamed
+            or "Content-Encoding" in response.headers):
+        return response
+    response.vary.add("Accept-Encoding")
+    if not request.accept_encodings["gzip"]:
+        return response
+    data = response.get_data()
+    if len(data) < GZIP_MIN_BYTES:
+        return response
+    response.set_data(gzip.compress(data, GZIP_LEVEL))
+    response.content_encoding = "gzip"
+    return response
+
+def init_app(app):
+    """
+    Loads the asset manifest and registers the asset route, the asset_url
+    template helper and HTML compression.
+    """
+    global _served_dir  # pylint: disable=global-statement
+    _served_dir = os.path.join(app.root_path, DIST_DIR)
+    _manifest.clear()
+    _manifest.update(load_manifest(_served_dir))
+    app.add_url_rule(URL_PREFIX + "<name>", "asset", asset_view)
+    app.add_template_global(asset_url)
+    app.after_request(compress_response)
+
+def main():
+    manifest = build()
+    print(f"assets: {len(manifest)} files written to {DIST_DIR}"
+          + ("" if brotli is not None else " (brotli not installed, gzip only)"))
+
+if __name__ == "__main__":
+    main()
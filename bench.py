@@ -0,0 +1,275 @@
+"""
+Route-level benchmark for the Vinyl Cabinet application.
+
+Builds (or reuses) a seeded database, drives the real Flask routes through
+the test client and reports latency percentiles, queries per request and
+throughput for each scenario. Results are written as JSON and can be
+compared against a stored baseline to flag regressions.
+
+Usage:
+    python3 bench.py --albums 100000 --output bench.json
+    python3 bench.py --albums 100000 --baseline bench.json
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sqlite3
+import sys
+import threading
+import time
+import db
+import database
+import writes
+
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+SORTS = ("newest", "oldest", "title", "artist", "year", "rating")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the application routes.")
+    parser.add_argument("--database", help="database file (default: bench-<albums>.db)")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--albums", type=int, default=100000)
+    parser.add_argument("--reviews", type=int, default=500000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reseed", action="store_true", help="rebuild an existing database")
+    parser.add_argument("--requests", type=int, default=50, help="requests per scenario")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="compare against results stored in this file")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed relative p95 slowdown before flagging a regression")
+    parser.add_argument("--min-delta", type=float, default=1.0,
+                        help="p95 slowdowns below this many milliseconds are ignored")
+    parser.add_argument("--write-stress", action="store_true",
+                        help="also compare concurrent direct writes with the write queue")
+    parser.add_argument("--writers", type=int, default=8, help="threads in the write stress test")
+    parser.add_argument("--writes", type=int, default=200, help="writes per stress test thread")
+    return parser.parse_args()
+
+def build_database(args):
+    """
+    Seeds the benchmark database unless a matching one already exists.
+    """
+    if os.path.exists(args.database) and not args.reseed:
+        return
+    subprocess.run([
+        sys.executable, "seed.py",
+        "--database", args.database,
+        "--users", str(args.users),
+        "--albums", str(args.albums),
+        "--reviews", str(args.reviews),
+        "--favorites", str(args.users),
+        "--seed", str(args.seed),
+    ], check=True)
+
+def queries_in(response):
+    """
+    Reads the statement count from the Server-Timing header set by metrics.py.
+    """
+    match = SERVER_TIMING_QUERIES.search(response.headers.get("Server-Timing", ""))
+    return int(match.group(1)) if match else 0
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+def build_scenarios(args, client, rng):
+    """
+    Returns (name, request function) pairs for every benchmarked route.
+    """
+    def get(url_factory):
+        return lambda: client.get(url_factory())
+
+    def random_album():
+        return rng.randint(1, args.albums)
+
+    deep_page = max(1, args.albums // 20 // 2)
+    deep_cursor = database.encode_cursor("newest", {"id": args.albums // 2}, "next")
+    scenarios = [
+        ("home", get(lambda: "/")),
+        ("search", get(lambda: f"/?query=Album+{rng.randint(1, 999)}")),
+        ("search_genre", get(lambda: "/?query=jazz")),
+        ("autocomplete", get(lambda: f"/api/autocomplete?q=Album+{rng.randint(1, 999)}")),
+        ("filter_genres", get(lambda: f"/?genre={rng.randint(1, 3)}&genre={rng.randint(4, 7)}")),
+        ("filter_years", get(lambda: f"/?year_from={rng.randint(1960, 2010)}"
+                                     f"&year_to={rng.randint(2011, 2020)}&genre=1")),
+        ("deep_page_offset", get(lambda: f"/?page={deep_page}")),
+        ("deep_page_cursor", get(lambda: f"/?cursor={deep_cursor}")),
+        ("album_detail", get(lambda: f"/album/{random_album()}")),
+        ("user_page", get(lambda: f"/user/user{rng.randint(1, args.users)}")),
+    ]
+    for sort in SORTS:
+        scenarios.append((f"sort_{sort}", get(lambda sort=sort: f"/?sort={sort}")))
+
+    with client.session_transaction() as session:
+        csrf_token = session["csrf_token"]
+    reviewed = set()
+
+    def post_review():
+        album_id = random_album()
+        while album_id in reviewed:
+            album_id = random_album()
+        reviewed.add(album_id)
+        return client.post(f"/review/{album_id}", data={
+            "csrf_token": csrf_token, "stars": str(rng.randint(1, 5)), "text": "bench"
+        })
+
+    def post_favorite():
+        return client.post(f"/favorite/{random_album()}", data={"csrf_token": csrf_token})
+
+    scenarios.append(("post_review", post_review))
+    scenarios.append(("post_favorite", post_favorite))
+    return scenarios
+
+def run_scenario(request, count):
+    latencies = []
+    queries = []
+    start = time.perf_counter()
+    for _ in range(count):
+        request_start = time.perf_counter()
+        response = request()
+        latencies.append((time.perf_counter() - request_start) * 1000)
+        queries.append(queries_in(response))
+        if response.status_code >= 400:
+            raise RuntimeError(f"request failed with status {response.status_code}")
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": count,
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        "queries_per_request": round(sum(queries) / count, 2),
+        "throughput_rps": round(count / elapsed, 1),
+    }
+
+def stress_writes(args, mode, first_user):
+    """
+    Inserts reviews from several threads at once, either each on its own
+    connection ("direct") or through the write queue ("queued"), and
+    returns the throughput and the number of lock errors.
+    """
+    sql = "INSERT INTO reviews (album_id, user_id, stars, text) VALUES (?, ?, ?, 'stress')"
+    errors = []
+
+    def writer(user_id):
+        con = db.connect() if mode == "direct" else None
+        for album_id in range(1, args.writes + 1):
+            params = (album_id, user_id, album_id % 5 + 1)
+            try:
+                if con is not None:
+                    con.execute(sql, params)
+                else:
+                    writes.execute(sql, params)
+            except sqlite3.OperationalError as error:
+                errors.append(error)
+        if con is not None:
+            con.close()
+
+    # Clear out reviews left by the seed so the inserts cannot collide.
+    users = range(first_user, first_user + args.writers)
+    db.execute_many("DELETE FROM reviews WHERE user_id = ?", [(user,) for user in users])
+    threads = [threading.Thread(target=writer, args=(user,)) for user in users]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    total = args.writers * args.writes
+    return {
+        "writes": total,
+        "lock_errors": len(errors),
+        "throughput_wps": round((total - len(errors)) / elapsed, 1),
+    }
+
+def compare(results, baseline, threshold, min_delta):
+    """
+    Prints a comparison against the baseline and returns the regressed scenarios.
+    """
+    regressions = []
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            continue
+        slower = (current["p95_ms"] > previous["p95_ms"] * (1 + threshold)
+                  and current["p95_ms"] - previous["p95_ms"] > min_delta)
+        more_queries = current["queries_per_request"] > previous["queries_per_request"] + 0.5
+        status = "REGRESSION" if slower or more_queries else "ok"
+        if status != "ok":
+            regressions.append(name)
+        print(f"{name:<20} p95 {previous['p95_ms']:>9.2f} -> {current['p95_ms']:>9.2f} ms  "
+              f"queries {previous['queries_per_request']:>5} -> "
+              f"{current['queries_per_request']:>5}  {status}")
+    return regressions
+
+def main():
+    args = parse_args()
+    args.database = args.database or f"bench-{args.albums}.db"
+    build_database(args)
+
+    # The write scenarios modify the data, so every run works on a fresh copy.
+    work_database = f"{args.database}.run"
+    shutil.copyfile(args.database, work_database)
+    db.DB_PATH = work_database
+
+    from app import app  # pylint: disable=import-outside-toplevel
+    app.config["TESTING"] = True
+    app.config["SERVER_TIMING"] = True
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = 1
+        session["username"] = "user1"
+        session["csrf_token"] = "bench"
+
+    rng = random.Random(args.seed)
+    results = {
+        "meta": {
+            "database": args.database,
+            "albums": args.albums,
+            "users": args.users,
+            "reviews": args.reviews,
+            "requests_per_scenario": args.requests,
+        },
+        "scenarios": {},
+    }
+    for name, request in build_scenarios(args, client, rng):
+        stats = run_scenario(request, args.requests)
+        results["scenarios"][name] = stats
+        print(f"{name:<20} p50 {stats['p50_ms']:>9.2f} ms  p95 {stats['p95_ms']:>9.2f} ms  "
+              f"p99 {stats['p99_ms']:>9.2f} ms  queries {stats['queries_per_request']:>5}  "
+              f"{stats['throughput_rps']:>8.1f} req/s")
+
+    if args.write_stress:
+        results["write_stress"] = {}
+        for index, mode in enumerate(("direct", "queued")):
+            stats = stress_writes(args, mode, 2 + index * args.writers)
+            results["write_stress"][mode] = stats
+            print(f"write_stress_{mode:<7} {stats['writes']} writes  "
+                  f"{stats['throughput_wps']:>8.1f} writes/s  lock errors {stats['lock_errors']}")
+
+    writes.stop()
+    db.close_pool()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(work_database + suffix):
+            os.remove(work_database + suffix)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            regressions = compare(
+                results, json.load(baseline_file), args.threshold, args.min_delta
+            )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(results, output_file, indent=2)
+    if regressions:
+        print(f"Regressions: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+In-process cache for reference data that rarely changes, such as genres.
+
+Each cached region has a generation counter in the cache_generations
+table. Triggers bump it when the underlying rows change and invalidate()
+bumps it explicitly, so every worker process drops its copy within
+CHECK_INTERVAL seconds without a restart.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from db import query, execute
+
+CHECK_INTERVAL = 1.0
+MAX_ENTRIES = 10000
+
+_lock = threading.Lock()
+_regions = {}
+_generations = {}
+_last_check = 0.0
+
+def check_generations():
+    """
+    Drops every region whose generation changed since it was cached.
+    """
+    global _last_check  # pylint: disable=global-statement
+    now = time.monotonic()
+    if now - _last_check < CHECK_INTERVAL:
+        return
+    rows = query("SELECT name, generation FROM cache_generations")
+    with _lock:
+        _last_check = now
+        for row in rows:
+            if _generations.get(row["name"]) != row["generation"]:
+                _generations[row["name"]] = row["generation"]
+                _regions.pop(row["name"], None)
+
+def get(region, key, loader):
+    """
+    Returns the cached value for key in region, calling loader() on a miss.
+    None results are not cached.
+    """
+    check_generations()
+    with _lock:
+        entries = _regions.get(region)
+        if entries is not None and key in entries:
+            entries.move_to_end(key)
+            return entries[key]
+    value = loader()
+    if value is not None:
+        with _lock:
+            entries = _regions.setdefault(region, OrderedDict())
+            entries[key] = value
+            if len(entries) > MAX_ENTRIES:
+                entries.popitem(last=False)
+    return value
+
+def invalidate(region):
+    """
+    Drops a region here and bumps its generation for other processes.
+    """
+    execute("""
+        INSERT INTO cache_generations (name, generation) VALUES (?, 1)
+        ON CONFLICT (name) DO UPDATE
+        SET generation = generation + 1, changed_at = CURRENT_TIMESTAMP
+    """, (region,))
+    with _lock:
+        _regions.pop(region, None)
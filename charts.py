@@ -0,0 +1,156 @@
+"""
+Top album charts ranked by Bayesian average rating.
+
+Ranking by plain average puts an album with one 5-star review above one
+with hundreds of reviews averaging 4.8. Charts instead rank by
+
+    score = (prior_weight * mean + sum of stars) / (prior_weight + reviews)
+
+which pulls albums with few reviews towards the mean of all reviews;
+prior_weight is the average number of reviews per reviewed album. The
+trending chart does the same with the reviews of the last TRENDING_DAYS
+days only.
+
+refresh() reads the priors from the album rating aggregates and the recent
+reviews, then streams per-album review totals in one grouped pass over
+reviews, offering each album to bounded heaps that keep the CHART_SIZE best
+of the all-time chart, every genre and decade and the trending chart. The
+charts replace chart_entries in one transaction. Chart pages are then plain
+indexed reads; run this on a schedule, e.g. hourly from cron.
+
+Usage:
+    python3 charts.py
+"""
+
+import heapq
+import time
+from datetime import datetime, timedelta, timezone
+import cache
+import db
+from db import query, execute, execute_many, iterate, transaction
+
+CHART_SIZE = 100
+TRENDING_DAYS = 30
+BATCH_SIZE = 10000
+
+PRIORS_SQL = """
+    SELECT a.albums, a.reviews, a.stars, r.recent_albums, r.recent_reviews, r.recent_stars
+    FROM (
+        SELECT COUNT(*) AS albums, IFNULL(SUM(review_count), 0) AS reviews,
+               IFNULL(SUM(rating_sum), 0) AS stars
+        FROM albums
+        WHERE review_count > 0
+    ) AS a, (
+        SELECT COUNT(DISTINCT album_id) AS recent_albums, COUNT(*) AS recent_reviews,
+               IFNULL(SUM(stars), 0) AS recent_stars
+        FROM reviews
+        WHERE created_at >= :since
+    ) AS r
+"""
+
+AGGREGATES_SQL = """
+    SELECT s.album_id, s.reviews, s.stars, s.recent_reviews, s.recent_stars,
+           IFNULL(a.release_year, 0) / 10 * 10 AS decade,
+           (SELECT group_concat(genre_id) FROM album_genres WHERE album_id = s.album_id)
+               AS genre_ids
+    FROM (
+        SELECT album_id, COUNT(*) AS reviews, SUM(stars) AS stars,
+               SUM(created_at >= :since) AS recent_reviews,
+               SUM(IIF(created_at >= :since, stars, 0)) AS recent_stars
+        FROM reviews
+        GROUP BY album_id
+    ) AS s
+    JOIN albums a ON a.id = s.album_id
+"""
+
+def prior(albums, reviews, stars):
+    """
+    Returns the (mean, prior_weight) pair for a set of reviewed albums.
+    """
+    if not albums:
+        return 0.0, 1.0
+    return stars / reviews, reviews / albums
+
+def bayesian(stars, reviews, mean, prior_weight):
+    return (prior_weight * mean + stars) / (prior_weight + reviews)
+
+def offer(heap, entry):
+    """
+    Adds an entry to a chart's min-heap, keeping its CHART_SIZE best.
+    """
+    if len(heap) < CHART_SIZE:
+        heapq.heappush(heap, entry)
+    elif entry > heap[0]:
+        heapq.heapreplace(heap, entry)
+
+def rank(since):
+    """
+    Computes every chart from the reviews. Returns a dict of
+    (kind, scope) -> ((mean, prior_weight), entries best first), where an
+    entry is (score, reviews, -album_id, average).
+    """
+    totals = query(PRIORS_SQL, {"since": since})[0]
+    all_time = prior(totals["albums"], totals["reviews"], totals["stars"])
+    trending = prior(totals["recent_albums"], totals["recent_reviews"], totals["recent_stars"])
+    heaps = {}
+    for rows in iterate(AGGREGATES_SQL, {"since": since}, BATCH_SIZE):
+        for album_id, reviews, stars, recent_reviews, recent_stars, decade, genre_ids in rows:
+            entry = (bayesian(stars, reviews, *all_time), reviews, -album_id, stars / reviews)
+            scopes = [("all", 0)]
+            if decade > 0:
+                scopes.append(("decade", decade))
+            if genre_ids:
+                scopes.extend(("genre", int(genre_id)) for genre_id in genre_ids.split(","))
+            for scope in scopes:
+                offer(heaps.setdefault(scope, []), entry)
+            if recent_reviews:
+                offer(heaps.setdefault(("trending", 0), []), (
+                    bayesian(recent_stars, recent_reviews, *trending),
+                    recent_reviews, -album_id, recent_stars / recent_reviews
+                ))
+
+    return {
+        scope: (trending if scope[0] == "trending" else all_time, sorted(heap, reverse=True))
+        for scope, heap in heaps.items()
+    }
+
+def refresh():
+    """
+    Recomputes every chart and replaces the stored ones. Returns the
+    number of charts.
+    """
+    since = (datetime.now(timezone.utc) - timedelta(days=TRENDING_DAYS)).strftime(
+        "%Y-%m-%d %H:%M:%S"
+    )
+    charts = rank(since)
+    with transaction():
+        execute("DELETE FROM chart_entries")
+        execute("DELETE FROM charts")
+        execute_many(
+            "INSERT INTO charts (kind, scope, mean, prior_weight) VALUES (?, ?, ?, ?)",
+            [(kind, scope, mean, prior_weight)
+             for (kind, scope), ((mean, prior_weight), _) in charts.items()]
+        )
+        # Albums deleted since the totals were read are left out.
+        execute_many("""
+            INSERT INTO chart_entries
+                (kind, scope, position, album_id, score, review_count, avg_rating)
+            SELECT ?, ?, ?, id, ?, ?, ?
+            FROM albums
+            WHERE id = ?
+        """, [
+            (kind, scope, position, score, reviews, average, -negative_id)
+            for (kind, scope), (_, entries) in charts.items()
+            for position, (score, reviews, negative_id, average) in enumerate(entries, start=1)
+        ])
+        cache.invalidate("pages")
+    return len(charts)
+
+def main():
+    start = time.perf_counter()
+    count = refresh()
+    db.close_pool()
+    print(f"charts: {count} charts refreshed in {time.perf_counter() - start:.1f} s")
+
+if __name__ == "__main__":
+    main()
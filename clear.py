@@ -6,11 +6,16 @@ import sqlite3
 
 db = sqlite3.connect("database.db")
 db.execute("PRAGMA foreign_keys = ON")
+db.execute("DELETE FROM similar_albums")
+db.execute("DELETE FROM chart_entries")
+db.execute("DELETE FROM charts")
 db.execute("DELETE FROM reviews")
 db.execute("DELETE FROM favorites")
 db.execute("DELETE FROM album_genres")
 db.execute("DELETE FROM user_profiles")
 db.execute("DELETE FROM albums")
+db.execute("DELETE FROM artists")
 db.execute("DELETE FROM users")
+db.execute("DELETE FROM similar_albums_changes")
 db.commit()
 db.close()
\ No newline at end of file
@@ -3,34 +3,49 @@ Database operations for the Vinyl Cabinet application.
 Handles CRUD operations for albums, genres, reviews, and user statistics.
 """
 
-from db import query, execute
+import base64
+import json
+import threading
+import time
+import unicodedata
+import cache
+import writes
+from db import query, execute, execute_many, transaction
 
+@writes.queued
 def add_album(title, artist, year, genre_ids, user_id, image_url=None):
     """
     Adds a new album to the database.
     """
     try:
-        album_id = execute(
-            "INSERT INTO albums (title, artist, year, genre, user_id, image_url) "
-            "VALUES (?, ?, ?, ?, ?, ?)",
-            (title, artist, year, '', user_id, image_url or None)
-        )
-        if genre_ids:
-            assign_genres_to_album(album_id, genre_ids)
+        with transaction():
+            album_id = execute(
+                "INSERT INTO albums (title, artist, year, genre, user_id, image_url, "
+                "title_key, artist_key, artist_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (title, artist, year, '', user_id, image_url or None,
+                 name_key(title), name_key(artist), get_artist_id(artist))
+            )
+            if genre_ids:
+                assign_genres_to_album(album_id, genre_ids)
         return True, "Album added successfully."
     except Exception as e:
         return False, str(e)
 
+@writes.queued
 def update_album(album_id, title, artist, year, genre_ids, image_url=None):
     """
     Updates an existing album in the database.
     """
-    execute("""
-        UPDATE albums SET title = ?, artist = ?, year = ?, genre = ?, image_url = ?
-        WHERE id = ?
-    """, (title, artist, year, '', image_url or None, album_id))
-    assign_genres_to_album(album_id, genre_ids)
+    with transaction():
+        execute("""
+            UPDATE albums SET title = ?, artist = ?, year = ?, genre = ?, image_url = ?,
+                              title_key = ?, artist_key = ?, artist_id = ?
+            WHERE id = ?
+        """, (title, artist, year, '', image_url or None,
+              name_key(title), name_key(artist), get_artist_id(artist), album_id))
+        assign_genres_to_album(album_id, genre_ids)
 
+@writes.queued
 def delete_album(album_id):
     """
     Deletes an album from the database.
@@ -39,20 +54,48 @@ def delete_album(album_id):
 
 def get_all_genres():
     """
-    Fetches all available genres from the database.
+    Fetches all available genres, served from the reference-data cache.
     """
-    rows = query("SELECT id, name FROM genres ORDER BY name")
-    return [dict(row) for row in rows]
+    def load():
+        rows = query("SELECT id, name FROM genres ORDER BY name")
+        return [dict(row) for row in rows]
+    return cache.get("genres", "all", load)
+
+def get_genre_names():
+    """
+    Returns a cached mapping of genre id to genre name.
+    """
+    return cache.get(
+        "genres", "names", lambda: {genre['id']: genre['name'] for genre in get_all_genres()}
+    )
+
+def get_genre_ids_by_name():
+    """
+    Returns a cached mapping of lowercased genre name to genre id.
+    """
+    return cache.get(
+        "genres", "ids", lambda: {genre['name'].lower(): genre['id'] for genre in get_all_genres()}
+    )
+
+def get_user_id(username):
+    """
+    Looks up a user's id by username through the reference-data cache.
+    """
+    def load():
+        rows = query("SELECT id FROM users WHERE username = ?", (username,))
+        return rows[0]['id'] if rows else None
+    return cache.get("users", username, load)
 
+@writes.queued
 def assign_genres_to_album(album_id, genre_ids):
     """
     Assigns genres to an album.
     """
-    execute("DELETE FROM album_genres WHERE album_id = ?", (album_id,))
-    for genre_id in genre_ids:
-        execute(
+    with transaction():
+        execute("DELETE FROM album_genres WHERE album_id = ?", (album_id,))
+        execute_many(
             "INSERT INTO album_genres (album_id, genre_id) VALUES (?, ?)",
-            (album_id, genre_id)
+            [(album_id, genre_id) for genre_id in genre_ids]
         )
 
 def get_album_genres(album_id):
@@ -68,6 +111,85 @@ def get_album_genres(album_id):
     """, (album_id,))
     return [dict(row) for row in rows]
 
+# Upper bound on ids per IN (...) list, well below SQLite's variable limit.
+IN_CHUNK_SIZE = 500
+
+def decorate_albums(albums, viewer_id=None):
+    """
+    Loads genres, average rating and the viewer's favorite status for all
+    given albums with one query per 500 albums.
+    """
+    genre_names = get_genre_names()
+    by_id = {}
+    for album in albums:
+        album['genres'] = []
+        album['is_favorite'] = False
+        by_id[album['id']] = album
+    album_ids = list(by_id)
+    for start in range(0, len(album_ids), IN_CHUNK_SIZE):
+        chunk = album_ids[start:start + IN_CHUNK_SIZE]
+        placeholders = ", ".join("?" for _ in chunk)
+        rows = query(f"""
+            SELECT a.id AS album_id, a.avg_rating,
+                   EXISTS (
+                       SELECT 1 FROM favorites f
+                       WHERE f.user_id = ? AND f.album_id = a.id
+                   ) AS is_favorite,
+                   ag.genre_id
+            FROM albums a
+            LEFT JOIN album_genres ag ON ag.album_id = a.id
+            WHERE a.id IN ({placeholders})
+        """, [viewer_id] + chunk)
+        for row in rows:
+            album = by_id[row['album_id']]
+            album['avg_stars'] = round(row['avg_rating'], 1) if row['avg_rating'] else None
+            album['is_favorite'] = bool(row['is_favorite'])
+            if row['genre_id'] in genre_names:
+                album['genres'].append(
+                    {'id': row['genre_id'], 'name': genre_names[row['genre_id']]}
+                )
+    for album in albums:
+        album['genres'].sort(key=lambda genre: genre['name'])
+    return albums
+
+@writes.queued
+def add_albums(user_id, albums):
+    """
+    Inserts validated albums (dicts with title, artist, year, image_url and
+    genre ids) and their genres with two executemany statements in one
+    transaction. Returns the new album ids.
+    """
+    with transaction():
+        # The writer holds the write lock, so ids past both the current maximum
+        # and the AUTOINCREMENT sequence stay free until the commit.
+        first_id = query("""
+            SELECT MAX(
+                COALESCE((SELECT MAX(id) FROM albums), 0),
+                COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'albums'), 0)
+            ) + 1 AS next_id
+        """)[0]['next_id']
+        album_ids = list(range(first_id, first_id + len(albums)))
+        artist_ids = {}
+        for album in albums:
+            key = name_key(album['artist'])
+            if key not in artist_ids:
+                artist_ids[key] = get_artist_id(album['artist'])
+        execute_many(
+            "INSERT INTO albums (id, title, artist, year, genre, user_id, image_url, "
+            "title_key, artist_key, artist_id) VALUES (?, ?, ?, ?, '', ?, ?, ?, ?, ?)",
+            [(album_id, album['title'], album['artist'], int(album['year']), user_id,
+              album.get('image_url') or None, name_key(album['title']),
+              name_key(album['artist']), artist_ids[name_key(album['artist'])])
+             for album_id, album in zip(album_ids, albums)]
+        )
+        execute_many(
+            "INSERT OR IGNORE INTO album_genres (album_id, genre_id) VALUES (?, ?)",
+            [(album_id, genre_id)
+             for album_id, album in zip(album_ids, albums)
+             for genre_id in album['genres']]
+        )
+    return album_ids
+
 def validate_album_data(data):
     """
     Validates album data for required fields and formats.
@@ -83,164 +205,543 @@ def validate_album_data(data):
         errors["genres"] = "At least one genre is required."
     return errors
 
-def get_sort_clause(sort):
+# Sort options as (key columns, direction). Every key ends in a.id so that
+# it is unique, which keyset pagination relies on.
+SORT_KEYS = {
+    'newest': (('a.id',), 'DESC'),
+    'oldest': (('a.id',), 'ASC'),
+    'title': (('a.title', 'a.id'), 'ASC'),
+    'artist': (('a.artist', 'a.id'), 'ASC'),
+    'year': (('a.year', 'a.id'), 'DESC'),
+    'rating': (('a.avg_rating', 'a.id'), 'DESC')
+}
+
+def get_sort_columns(sort, search=False):
+    """
+    Returns the key columns of a sort. Searches key on the FTS rowid, which
+    equals a.id, so that FTS5 returns matches already in id order.
+    """
+    columns, _ = SORT_KEYS[sort]
+    if search:
+        return tuple('f.rowid' if column == 'a.id' else column for column in columns)
+    return columns
+
+def get_sort_clause(sort, search=False):
     """Returns the ORDER BY clause based on sort parameter."""
-    sort_options = {
-        'newest': 'a.id DESC',
-        'oldest': 'a.id ASC',
-        'title': 'a.title ASC',
-        'artist': 'a.artist ASC',
-        'year': 'a.year DESC',
-        'rating': 'avg_rating DESC, a.id DESC'
-    }
-    return sort_options.get(sort, 'a.id DESC')
+    if search and sort == 'relevance':
+        return 'f.rank, a.id DESC'
+    sort = sort if sort in SORT_KEYS else 'newest'
+    _, direction = SORT_KEYS[sort]
+    return ", ".join(f"{column} {direction}" for column in get_sort_columns(sort, search))
 
-def search_albums(query_text, user_id=None, page=1, per_page=20, sort='newest'):
+def encode_cursor(sort, album, direction):
     """
-    Searches albums based on title, artist, or genre.
+    Builds an opaque cursor that pages forward ('next') or backward ('prev')
+    from the given album's sort key.
     """
-    search_terms = query_text.split()
+    columns, _ = SORT_KEYS[sort]
+    values = [album[column.split('.')[1]] for column in columns]
+    payload = json.dumps([sort, direction, values]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
 
-    if not search_terms:
-        return [], 0
+def decode_cursor(cursor, sort):
+    """
+    Decodes a cursor into (direction, key values).
+    Returns None if the cursor is malformed or was made for another sort.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, direction, values = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        return None
+    columns, _ = SORT_KEYS.get(sort, ((), None))
+    if cursor_sort != sort or direction not in ('next', 'prev') or len(values) != len(columns):
+        return None
+    return direction, values
 
-    conditions = []
-    params = []
+def get_keyset_clause(sort, direction, search=False):
+    """
+    Returns the WHERE condition and ORDER BY clause that seek past a cursor.
+    Backward pages are fetched in reverse order and flipped by the caller.
+    """
+    _, sort_direction = SORT_KEYS[sort]
+    columns = get_sort_columns(sort, search)
+    descending = (sort_direction == 'DESC') != (direction == 'prev')
+    placeholders = ", ".join("?" for _ in columns)
+    condition = f"({', '.join(columns)}) {'<' if descending else '>'} ({placeholders})"
+    order_by = ", ".join(f"{column} {'DESC' if descending else 'ASC'}" for column in columns)
+    return condition, order_by
 
-    for term in search_terms:
-        term_pattern = f"%{term}%"
-        conditions.append(
-            "(a.title LIKE ? OR a.artist LIKE ? OR g.name LIKE ? "
-            "OR CAST(a.year AS TEXT) LIKE ?)"
-        )
-        params.extend([term_pattern, term_pattern, term_pattern, term_pattern])
+def fetch_album_page(select_sql, conditions, params, sort, page, per_page, cursor, search=False):
+    """
+    Runs an album listing query for one page, either by keyset cursor or by
+    page number, and returns the albums and cursors for the adjacent pages.
+    """
+    conditions = list(conditions)
+    params = list(params)
+    keyset = decode_cursor(cursor, sort) if cursor and sort in SORT_KEYS else None
 
-    where_clause = " AND ".join(conditions)
+    if keyset:
+        direction, values = keyset
+        condition, order_by = get_keyset_clause(sort, direction, search)
+        conditions.append(condition)
+        params.extend(values)
+        offset = 0
+    else:
+        direction = None
+        order_by = get_sort_clause(sort, search)
+        offset = (page - 1) * per_page
 
-    count_sql = f"""
-        SELECT COUNT(DISTINCT a.id) as total
-        FROM albums a
-        JOIN users u ON a.user_id = u.id
-        LEFT JOIN album_genres ag ON a.id = ag.album_id
-        LEFT JOIN genres g ON ag.genre_id = g.id
-        WHERE {where_clause}
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    sql = f"{select_sql} {where} ORDER BY {order_by} LIMIT ? OFFSET ?"
+    rows = query(sql, params + [per_page + 1, offset])
+
+    has_more = len(rows) > per_page
+    albums = [dict(row) for row in rows[:per_page]]
+    if direction == 'prev':
+        albums.reverse()
+
+    cursors = {'prev': None, 'next': None}
+    if albums and sort in SORT_KEYS:
+        if direction == 'prev' or has_more:
+            cursors['next'] = encode_cursor(sort, albums[-1], 'next')
+        if (direction == 'next' or (direction == 'prev' and has_more)
+                or (not direction and page > 1)):
+            cursors['prev'] = encode_cursor(sort, albums[0], 'prev')
+    return albums, cursors
+
+# Search totals are cached briefly per normalized query, and by default only
+# counted up to SEARCH_COUNT_CAP so that broad searches never scan every match.
+SEARCH_COUNT_CAP = 10000
+SEARCH_COUNT_TTL = 30
+SEARCH_COUNT_CACHE_SIZE = 1024
+_search_counts = {}
+_search_count_lock = threading.Lock()
+
+def build_match_query(query_text):
+    """
+    Turns free search text into an FTS5 query where every term must match
+    the start of a word in the title, artist, genres or year.
     """
-    total = query(count_sql, params)[0]['total']
+    terms = query_text.split()
+    return " ".join('"' + term.replace('"', '""') + '"*' for term in terms)
 
-    offset = (page - 1) * per_page
-    order_by = get_sort_clause(sort)
+def count_search_results(match, count_cap=SEARCH_COUNT_CAP, conditions=(), params=()):
+    """
+    Counts albums matching an FTS query and optional extra conditions on
+    albums a, reusing counts from the last SEARCH_COUNT_TTL seconds. With a
+    count_cap, at most count_cap + 1 matches are counted, so a larger total
+    means "more than count_cap".
+    """
+    key = (match, count_cap, tuple(conditions), tuple(params))
+    now = time.monotonic()
+    with _search_count_lock:
+        cached = _search_counts.get(key)
+        if cached and cached[0] > now:
+            return cached[1]
 
-    sql = f"""
-        SELECT DISTINCT a.id, a.title, a.artist, a.year, a.image_url, a.user_id,
-               u.username AS owner_username,
-               (SELECT AVG(stars) FROM reviews WHERE album_id = a.id) as avg_rating
-        FROM albums a
+    where = " AND ".join(["albums_fts MATCH ?", *conditions])
+    source = "albums_fts f JOIN albums a ON a.id = f.rowid" if conditions else "albums_fts"
+    if count_cap is None:
+        sql = f"SELECT COUNT(*) as total FROM {source} WHERE {where}"
+        sql_params = (match, *params)
+    else:
+        sql = f"""
+            SELECT COUNT(*) as total
+            FROM (SELECT 1 FROM {source} WHERE {where} LIMIT ?)
+        """
+        sql_params = (match, *params, count_cap + 1)
+    total = query(sql, sql_params)[0]['total']
+
+    with _search_count_lock:
+        if len(_search_counts) >= SEARCH_COUNT_CACHE_SIZE:
+            _search_counts.clear()
+        _search_counts[key] = (now + SEARCH_COUNT_TTL, total)
+    return total
+
+def search_albums(query_text, user_id=None, page=1, per_page=20, sort='newest', cursor=None,
+                  count_cap=SEARCH_COUNT_CAP, filters=None):
+    """
+    Searches albums based on title, artist, genre, or year, optionally
+    narrowed by genre and year filters.
+    """
+    match = build_match_query(query_text.lower())
+
+    if not match:
+        return [], 0, {'prev': None, 'next': None}
+
+    # The FTS index drives the search, so filters are checked per match.
+    conditions, params = get_filter_conditions(filters, selective=False)
+    total = count_search_results(match, count_cap, conditions, params)
+
+    sql = """
+        SELECT a.id, a.title, a.artist, a.artist_id, a.year, a.image_url, a.user_id,
+               a.avg_rating, u.username AS owner_username
+        FROM albums_fts f
+        JOIN albums a ON a.id = f.rowid
         JOIN users u ON a.user_id = u.id
-        LEFT JOIN album_genres ag ON a.id = ag.album_id
-        LEFT JOIN genres g ON ag.genre_id = g.id
-        WHERE {where_clause}
-        ORDER BY {order_by}
-        LIMIT ? OFFSET ?
     """
+    albums, cursors = fetch_album_page(
+        sql, ["albums_fts MATCH ?", *conditions], [match, *params], sort, page, per_page, cursor,
+        search=True
+    )
+    decorate_albums(albums, user_id)
+    return albums, total, cursors
 
-    rows = query(sql, params + [per_page, offset])
-    albums = [dict(row) for row in rows]
-    for album in albums:
-        album['genres'] = get_album_genres(album['id'])
-    return albums, total
+def rebuild_search_index():
+    """
+    Repopulates the full-text search index from the albums and genres tables.
+    """
+    with transaction():
+        execute("DELETE FROM albums_fts")
+        execute("""
+            INSERT INTO albums_fts (rowid, title, artist, genres, year)
+            SELECT a.id, a.title, a.artist,
+                   (SELECT group_concat(g.name, ' ')
+                    FROM album_genres ag
+                    JOIN genres g ON ag.genre_id = g.id
+                    WHERE ag.album_id = a.id),
+                   a.year
+            FROM albums a
+        """)
+    execute("INSERT INTO albums_fts (albums_fts) VALUES ('optimize')")
 
-def get_all_albums(user_id=None, page=1, per_page=20, sort='newest'):
+def rebuild_table_counts():
     """
-    Fetches all albums with pagination.
+    Recomputes the row counters that triggers maintain in table_counts.
     """
-    count_sql = "SELECT COUNT(DISTINCT a.id) as total FROM albums a"
-    total = query(count_sql)[0]['total']
+    execute("""
+        INSERT OR REPLACE INTO table_counts (name, total)
+        SELECT 'albums', COUNT(*) FROM albums
+    """)
 
-    offset = (page - 1) * per_page
-    order_by = get_sort_clause(sort)
+def backfill_album_ratings():
+    """
+    Recomputes the denormalized review count and rating columns on albums.
+    """
+    with transaction():
+        execute("UPDATE albums SET review_count = 0, rating_sum = 0, avg_rating = 0")
+        execute("""
+            UPDATE albums
+            SET review_count = r.review_count,
+                rating_sum = r.rating_sum,
+                avg_rating = r.rating_sum * 1.0 / r.review_count
+            FROM (
+                SELECT album_id, COUNT(*) AS review_count, SUM(stars) AS rating_sum
+                FROM reviews
+                GROUP BY album_id
+            ) AS r
+            WHERE albums.id = r.album_id
+        """)
 
-    sql = f"""
-        SELECT DISTINCT a.id, a.title, a.artist, a.year, a.image_url, a.user_id,
-               u.username AS owner_username,
-               (SELECT AVG(stars) FROM reviews WHERE album_id = a.id) as avg_rating
-        FROM albums a
-        JOIN users u ON a.user_id = u.id
-        LEFT JOIN album_genres ag ON a.id = ag.album_id
-        ORDER BY {order_by}
-        LIMIT ? OFFSET ?
+def make_filters(genre_ids=(), year_from=None, year_to=None):
     """
-    rows = query(sql, (per_page, offset))
-    albums = [dict(row) for row in rows]
-    for album in albums:
-        album['genres'] = get_album_genres(album['id'])
-    return albums, total
+    Normalizes genre and year range filters, or returns None if none are set.
+    """
+    genre_ids = tuple(sorted(set(genre_ids)))
+    if not genre_ids and year_from is None and year_to is None:
+        return None
+    if year_from is not None and year_to is not None and year_from > year_to:
+        year_from, year_to = year_to, year_from
+    return {'genre_ids': genre_ids, 'year_from': year_from, 'year_to': year_to}
 
-def get_user_favorites(user_id):
+def get_filter_conditions(filters, selective, index_years=None):
     """
-    Fetches favorite albums for a specific user.
+    Returns SQL conditions on albums a for the filters. Selective filters
+    are looked up through the genre and year indexes; otherwise they are
+    written so that SQLite checks them while walking the sort order.
+    index_years (default: selective) controls the year index on its own.
     """
-    sql = """
-        SELECT a.id, a.title, a.artist, a.year, a.image_url,
-               (SELECT 1 FROM favorites f WHERE f.album_id = a.id AND f.user_id = ?) AS is_favorite
-        FROM albums a
-        JOIN favorites f2 ON a.id = f2.album_id
-        WHERE f2.user_id = ?
+    if index_years is None:
+        index_years = selective
+    if not filters:
+        return [], []
+    conditions = []
+    params = []
+    genre_ids = filters['genre_ids']
+    if genre_ids:
+        placeholders = ", ".join("?" for _ in genre_ids)
+        if selective:
+            conditions.append(
+                f"a.id IN (SELECT album_id FROM album_genres WHERE genre_id IN ({placeholders}))"
+            )
+        else:
+            conditions.append(
+                "EXISTS (SELECT 1 FROM album_genres ag "
+                f"WHERE ag.album_id = a.id AND ag.genre_id IN ({placeholders}))"
+            )
+        params.extend(genre_ids)
+    year = "a.release_year" if index_years else "+a.release_year"
+    if filters['year_from'] is not None:
+        conditions.append(f"{year} >= ?")
+        params.append(filters['year_from'])
+    if filters['year_to'] is not None:
+        conditions.append(f"{year} <= ?")
+        params.append(filters['year_to'])
+    return conditions, params
+
+def get_album_facets(filters=None):
     """
-    rows = query(sql, (user_id, user_id))
-    albums = [dict(row) for row in rows]
-    for album in albums:
-        album['genres'] = get_album_genres(album['id'])
-    return albums
+    Reads the maintained album_facets counts and returns the genre and
+    decade facets for the filter sidebar, plus the estimated number of
+    albums matching the filters. Counts are kept per decade: genre counts
+    cover the decades the year range touches, and decade counts follow the
+    genre filter when a single genre is selected. 'exact' tells whether
+    'matches' is an exact count rather than an upper bound; 'albums' is the
+    number of albums overall.
+    """
+    rows = query("SELECT genre_id, decade, total FROM album_facets WHERE total > 0")
+    genre_ids = filters['genre_ids'] if filters else ()
+    year_from = filters['year_from'] if filters else None
+    year_to = filters['year_to'] if filters else None
+    first_decade = None if year_from is None else year_from // 10 * 10
+    last_decade = None if year_to is None else year_to // 10 * 10
+
+    def in_range(decade):
+        return ((first_decade is None or decade >= first_decade)
+                and (last_decade is None or decade <= last_decade))
 
-def get_user_albums(user_id):
+    genre_counts = {}
+    decade_counts = {}
+    decade_genre = genre_ids[0] if len(genre_ids) == 1 else 0
+    matches = 0
+    albums = 0
+    for row in rows:
+        if row['genre_id'] == 0:
+            albums += row['total']
+        if row['genre_id'] == decade_genre and row['decade']:
+            decade_counts[row['decade']] = row['total']
+        if not in_range(row['decade']):
+            continue
+        if row['genre_id']:
+            genre_counts[row['genre_id']] = genre_counts.get(row['genre_id'], 0) + row['total']
+        if (row['genre_id'] in genre_ids) if genre_ids else row['genre_id'] == 0:
+            matches += row['total']
+
+    names = get_genre_names()
+    return {
+        'genres': sorted(
+            ({'id': genre_id, 'name': names.get(genre_id, ''), 'count': count}
+             for genre_id, count in genre_counts.items() if genre_id in names),
+            key=lambda genre: genre['name']
+        ),
+        'decades': [{'decade': decade, 'count': count}
+                    for decade, count in sorted(decade_counts.items())],
+        'matches': matches,
+        'albums': albums,
+        'exact': (len(genre_ids) <= 1
+                  and (year_from is None or year_from % 10 == 0)
+                  and (year_to is None or year_to % 10 == 9)),
+    }
+
+# Filters expected to match at least this share of all albums are checked
+# while walking the sort order, which finds a page of matches quickly; rarer
+# ones are looked up through the indexes and their few matches sorted.
+FILTER_SCAN_MIN_FRACTION = 0.01
+
+def get_all_albums(user_id=None, page=1, per_page=20, sort='newest', cursor=None,
+                   filters=None, facets=None, count_cap=SEARCH_COUNT_CAP):
     """
-    Fetches albums added by a specific user.
+    Fetches all albums with pagination, optionally filtered by genre and
+    year range. Pass the facets from get_album_facets() to avoid reading
+    them twice; they also carry the album total.
     """
+    if filters and not facets:
+        facets = get_album_facets(filters)
+    if facets:
+        total = facets['albums']
+    else:
+        total = query("SELECT total FROM table_counts WHERE name = 'albums'")[0]['total']
+    conditions, params = [], []
+
+    if filters:
+        selective = facets['matches'] < total * FILTER_SCAN_MIN_FRACTION
+        conditions, params = get_filter_conditions(filters, selective)
+        if facets['exact']:
+            total = facets['matches']
+        else:
+            # Counting stops after count_cap + 1 matches, so walking albums while
+            # checking genres beats collecting every album of the genres first.
+            count_conditions, count_params = get_filter_conditions(
+                filters, selective, index_years=True
+            )
+            total = query(f"""
+                SELECT COUNT(*) AS total
+                FROM (SELECT 1 FROM albums a WHERE {' AND '.join(count_conditions)} LIMIT ?)
+            """, count_params + [count_cap + 1])[0]['total']
+
     sql = """
-        SELECT DISTINCT a.id, a.title, a.artist, a.year, a.image_url,
-               u.username AS owner_username
+        SELECT a.id, a.title, a.artist, a.artist_id, a.year, a.image_url, a.user_id,
+               a.avg_rating, u.username AS owner_username
         FROM albums a
         JOIN users u ON a.user_id = u.id
-        LEFT JOIN album_genres ag ON a.id = ag.album_id
-        WHERE a.user_id = ?
     """
-    rows = query(sql, (user_id,))
-    albums = [dict(row) for row in rows]
-    for album in albums:
-        album['genres'] = get_album_genres(album['id'])
-    return albums
+    albums, cursors = fetch_album_page(sql, conditions, params, sort, page, per_page, cursor)
+    decorate_albums(albums, user_id)
+    return albums, total, cursors
 
-def get_user_stats(user_id):
-    """Get statistics for a user: num albums, total reviews, avg album rating."""
-    stats = {}
-    stats['num_albums'] = query(
-        "SELECT COUNT(id) as count FROM albums WHERE user_id = ?",
-        (user_id,)
-    )[0]['count']
-    stats['total_reviews'] = query("""
-        SELECT COUNT(r.id) as count
-        FROM reviews r
-        JOIN albums a ON r.album_id = a.id
-        WHERE a.user_id = ?
-    """, (user_id,))[0]['count']
-    avg_rating = query("""
-        SELECT AVG(r.stars) as avg
-        FROM reviews r
-        JOIN albums a ON r.album_id = a.id
-        WHERE a.user_id = ?
+def rebuild_album_facets():
+    """
+    Recomputes the genre and decade counts that triggers maintain in album_facets.
+    """
+    with transaction():
+        execute("DELETE FROM album_facets")
+        execute("""
+            INSERT INTO album_facets (genre_id, decade, total)
+            SELECT 0, IFNULL(release_year, 0) / 10 * 10, COUNT(*)
+            FROM albums
+            GROUP BY 2
+        """)
+        execute("""
+            INSERT INTO album_facets (genre_id, decade, total)
+            SELECT ag.genre_id, IFNULL(a.release_year, 0) / 10 * 10, COUNT(*)
+            FROM album_genres ag
+            JOIN albums a ON a.id = ag.album_id
+            GROUP BY 1, 2
+        """)
+
+USER_ALBUMS_PER_PAGE = 24
+PROFILE_FIELDS = (
+    'id', 'username', 'bio', 'location', 'profile_image_url',
+    'joined_date', 'favorite_genre_id', 'favorite_genre'
+)
+
+def user_stats_from_row(row):
+    """
+    Builds the profile statistics dict from a user_stats row (or None).
+    """
+    if not row or row['num_albums'] is None:
+        return {'num_albums': 0, 'total_reviews': 0, 'avg_album_rating': 0, 'reviews_written': 0}
+    return {
+        'num_albums': row['num_albums'],
+        'total_reviews': row['reviews_received'],
+        'avg_album_rating': (
+            round(row['rating_sum'] / row['reviews_received'], 1)
+            if row['reviews_received'] else 0
+        ),
+        'reviews_written': row['reviews_written'],
+    }
+
+def get_user_page(user_id, viewer_id=None, page=1, per_page=USER_ALBUMS_PER_PAGE):
+    """
+    Loads everything the profile page shows with a fixed number of queries:
+    profile and stats, one page of the user's albums, recent activity, the
+    viewer's other favorites (first page only) and one decoration query.
+    """
+    rows = query("""
+        SELECT u.id, u.username, up.bio, up.location, up.profile_image_url,
+               up.joined_date, up.favorite_genre_id, g.name as favorite_genre,
+               s.num_albums, s.reviews_received, s.rating_sum, s.reviews_written
+        FROM users u
+        LEFT JOIN user_profiles up ON u.id = up.user_id
+        LEFT JOIN genres g ON up.favorite_genre_id = g.id
+        LEFT JOIN user_stats s ON u.id = s.user_id
+        WHERE u.id = ?
     """, (user_id,))
-    stats['avg_album_rating'] = (
-        round(avg_rating[0]['avg'], 1) if avg_rating[0]['avg'] else 0
-    )
+    if not rows:
+        return None
+    header = rows[0]
+    profile = {key: header[key] for key in PROFILE_FIELDS}
+    stats = user_stats_from_row(header)
+    total_pages = max(1, (stats['num_albums'] + per_page - 1) // per_page)
+
+    rows = query("""
+        SELECT id, title, artist, year, image_url, user_id
+        FROM albums
+        WHERE user_id = ?
+        ORDER BY id DESC
+        LIMIT ? OFFSET ?
+    """, (user_id, per_page, (page - 1) * per_page))
+    albums = [dict(row, owner_username=header['username']) for row in rows]
+
+    rows = query("""
+        SELECT * FROM (
+            SELECT 'album' AS kind, id, title, artist, NULL AS stars, NULL AS text,
+                   NULL AS created_at, NULL AS album_id, NULL AS album_title
+            FROM albums
+            WHERE user_id = ?
+            ORDER BY id DESC
+            LIMIT 5
+        )
+        UNION ALL
+        SELECT * FROM (
+            SELECT 'review', r.id, NULL, NULL, r.stars, r.text,
+                   r.created_at, a.id, a.title
+            FROM reviews r
+            JOIN albums a ON r.album_id = a.id
+            WHERE r.user_id = ?
+            ORDER BY r.created_at DESC
+            LIMIT 5
+        )
+    """, (user_id, user_id))
+    activity = {
+        'recent_albums': [
+            {'id': row['id'], 'title': row['title'], 'artist': row['artist']}
+            for row in rows if row['kind'] == 'album'
+        ],
+        'recent_reviews': [
+            {'id': row['id'], 'stars': row['stars'], 'text': row['text'],
+             'created_at': row['created_at'], 'album_title': row['album_title'],
+             'album_id': row['album_id']}
+            for row in rows if row['kind'] == 'review'
+        ],
+    }
+
+    if viewer_id and page == 1:
+        rows = query("""
+            SELECT a.id, a.title, a.artist, a.year, a.image_url, a.user_id
+            FROM favorites f
+            JOIN albums a ON a.id = f.album_id
+            WHERE f.user_id = ? AND a.user_id != ?
+        """, (viewer_id, user_id))
+        albums.extend(dict(row) for row in rows)
+    decorate_albums(albums, viewer_id)
+
+    return {
+        'profile': profile,
+        'stats': stats,
+        'albums': albums,
+        'activity': activity,
+        'page': page,
+        'total_pages': total_pages,
+    }
+
+def rebuild_user_stats():
+    """
+    Recomputes the user_stats table from users, albums and reviews.
+    Uses the album rating aggregates, so run it after backfill_album_ratings().
+    """
+    with transaction():
+        execute("DELETE FROM user_stats")
+        execute("""
+            INSERT INTO user_stats
+                (user_id, num_albums, reviews_received, rating_sum, reviews_written)
+            SELECT u.id,
+                   COALESCE(a.num_albums, 0),
+                   COALESCE(a.reviews_received, 0),
+                   COALESCE(a.rating_sum, 0),
+                   COALESCE(r.reviews_written, 0)
+            FROM users u
+            LEFT JOIN (
+                SELECT user_id, COUNT(*) AS num_albums,
+                       SUM(review_count) AS reviews_received, SUM(rating_sum) AS rating_sum
+                FROM albums
+                GROUP BY user_id
+            ) AS a ON a.user_id = u.id
+            LEFT JOIN (
+                SELECT user_id, COUNT(*) AS reviews_written
+                FROM reviews
+                GROUP BY user_id
+            ) AS r ON r.user_id = u.id
+        """)
 
-    return stats
 def get_album_by_id(album_id):
     """
     Fetches a single album by its ID.
     """
     sql = """
-        SELECT a.id, a.title, a.artist, a.year, a.image_url, a.user_id,
-               u.username AS owner_username
+        SELECT a.id, a.title, a.artist, a.artist_id, a.year, a.image_url, a.user_id,
+               a.avg_rating, u.username AS owner_username
         FROM albums a
         JOIN users u ON a.user_id = u.id
         WHERE a.id = ?
@@ -249,9 +750,271 @@ def get_album_by_id(album_id):
     if not rows:
         return None
     album = dict(rows[0])
+    album['avg_stars'] = round(album['avg_rating'], 1) if album['avg_rating'] else None
     album['genres'] = get_album_genres(album_id)
     return album
 
+def name_key(text):
+    """
+    Folds a title or artist for prefix matching: accents removed, case
+    folded and whitespace collapsed, so "Björk" and " bjork" share a key.
+    """
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(stripped.casefold().split())
+
+def get_artist_id(name):
+    """
+    Returns the id of the artist whose folded name matches name, adding the
+    artist if there is none. Use it inside the transaction that links an
+    album to the artist, so an unused new artist is rolled back with it.
+    """
+    return query("""
+        INSERT INTO artists (name, name_key) VALUES (?, ?)
+        ON CONFLICT (name_key) DO UPDATE SET name = name
+        RETURNING id
+    """, (name, name_key(name)))[0]['id']
+
+def backfill_artists(batch_size=10000):
+    """
+    Links albums without an artist_id to their artists, creating artists as
+    needed, one transaction per batch. The triggers count each album as it
+    is linked.
+    """
+    last_id = 0
+    while True:
+        rows = query("""
+            SELECT id, artist FROM albums
+            WHERE id > ? AND artist_id IS NULL
+            ORDER BY id
+            LIMIT ?
+        """, (last_id, batch_size))
+        if not rows:
+            break
+        with transaction():
+            artist_ids = {}
+            for row in rows:
+                key = name_key(row['artist'])
+                if key not in artist_ids:
+                    artist_ids[key] = get_artist_id(row['artist'])
+            # Albums edited since they were read already have their artist.
+            execute_many(
+                "UPDATE albums SET artist_key = ?, artist_id = ? "
+                "WHERE id = ? AND artist_id IS NULL",
+                [(name_key(row['artist']), artist_ids[name_key(row['artist'])], row['id'])
+                 for row in rows]
+            )
+        last_id = rows[-1]['id']
+
+def rebuild_artist_counts():
+    """
+    Recomputes the album and review counters on artists and removes artists
+    without albums. Uses the album rating aggregates, so run it after
+    backfill_album_ratings().
+    """
+    with transaction():
+        execute("""
+            DELETE FROM artists
+            WHERE id NOT IN (SELECT artist_id FROM albums WHERE artist_id IS NOT NULL)
+        """)
+        execute("""
+            UPDATE artists
+            SET album_count = a.album_count,
+                review_count = a.review_count,
+                rating_sum = a.rating_sum
+            FROM (
+                SELECT artist_id, COUNT(*) AS album_count,
+                       SUM(review_count) AS review_count, SUM(rating_sum) AS rating_sum
+                FROM albums
+                WHERE artist_id IS NOT NULL
+                GROUP BY artist_id
+            ) AS a
+            WHERE artists.id = a.artist_id
+        """)
+
+ARTIST_ALBUMS_PER_PAGE = 24
+
+def get_artist_page(artist_id, viewer_id=None, cursor=None, per_page=ARTIST_ALBUMS_PER_PAGE):
+    """
+    Fetches an artist with their statistics and one page of their albums,
+    newest release first, paged by keyset cursor. Returns None if the
+    artist does not exist.
+    """
+    rows = query("""
+        SELECT id, name, album_count, review_count,
+               CASE WHEN review_count > 0 THEN rating_sum * 1.0 / review_count END AS avg_rating
+        FROM artists
+        WHERE id = ?
+    """, (artist_id,))
+    if not rows:
+        return None
+    sql = """
+        SELECT a.id, a.title, a.artist, a.artist_id, a.year, a.image_url, a.user_id,
+               a.avg_rating, a.review_count, u.username AS owner_username
+        FROM albums a
+        JOIN users u ON a.user_id = u.id
+    """
+    albums, cursors = fetch_album_page(
+        sql, ["a.artist_id = ?"], [artist_id], 'year', 1, per_page, cursor
+    )
+    decorate_albums(albums, viewer_id)
+    return {'artist': dict(rows[0]), 'albums': albums, 'cursors': cursors}
+
+def rebuild_name_keys(batch_size=10000):
+    """
+    Recomputes title_key and artist_key for every album, in batches.
+    """
+    last_id = 0
+    while True:
+        rows = query(
+            "SELECT id, title, artist FROM albums WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, batch_size)
+        )
+        if not rows:
+            break
+        with transaction():
+            execute_many(
+                "UPDATE albums SET title_key = ?, artist_key = ? WHERE id = ?",
+                [(name_key(row['title']), name_key(row['artist']), row['id']) for row in rows]
+            )
+        last_id = rows[-1]['id']
+
+# Suggestions are cached per folded prefix for AUTOCOMPLETE_TTL seconds. A
+# prefix matching at most AUTOCOMPLETE_SCAN_LIMIT albums (or artists) is read
+# through its key index and sorted; a more common one walks the table by
+# popularity until enough match, which takes at most
+# limit * rows / AUTOCOMPLETE_SCAN_LIMIT rows.
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_MAX_LIMIT = 25
+AUTOCOMPLETE_SCAN_LIMIT = 2000
+AUTOCOMPLETE_TTL = 60
+AUTOCOMPLETE_CACHE_SIZE = 4096
+_suggestions = {}
+_suggestions_lock = threading.Lock()
+
+def is_common_prefix(table, column, low, high):
+    """
+    Tells whether more than AUTOCOMPLETE_SCAN_LIMIT rows of table have a key
+    in [low, high), counting no further than that from the key index.
+    """
+    return query(f"""
+        SELECT COUNT(*) AS matches
+        FROM (SELECT 1 FROM {table} WHERE {column} >= ? AND {column} < ? LIMIT ?)
+    """, (low, high, AUTOCOMPLETE_SCAN_LIMIT + 1))[0]['matches'] > AUTOCOMPLETE_SCAN_LIMIT
+
+def suggest_titles(low, high, limit):
+    """
+    Returns the most reviewed albums whose title key is in [low, high).
+    """
+    # The unary + keeps a common prefix from using the title index.
+    column = "+title_key" if is_common_prefix("albums", "title_key", low, high) else "title_key"
+    rows = query(f"""
+        SELECT id, title, artist, review_count
+        FROM albums
+        WHERE {column} >= ? AND {column} < ?
+        ORDER BY review_count DESC, id
+        LIMIT ?
+    """, (low, high, limit))
+    return [dict(row) for row in rows]
+
+def suggest_artists(low, high, limit):
+    """
+    Returns the most reviewed artists whose name key is in [low, high).
+    """
+    column = "+name_key" if is_common_prefix("artists", "name_key", low, high) else "name_key"
+    rows = query(f"""
+        SELECT id, name AS artist, review_count
+        FROM artists
+        WHERE {column} >= ? AND {column} < ?
+        ORDER BY review_count DESC, id
+        LIMIT ?
+    """, (low, high, limit))
+    return [dict(row) for row in rows]
+
+def get_suggestions(prefix, limit=AUTOCOMPLETE_LIMIT):
+    """
+    Returns {'titles': [...], 'artists': [...]} with the most reviewed
+    albums and artists starting with prefix, ignoring case and accents.
+    """
+    key = name_key(prefix)
+    if not key:
+        return {'titles': [], 'artists': []}
+    now = time.monotonic()
+    with _suggestions_lock:
+        cached = _suggestions.get((key, limit))
+        if cached and cached[0] > now:
+            return cached[1]
+
+    # Keys sort by code point, so every key starting with the prefix is
+    # below the prefix followed by the highest code point.
+    low, high = key, key + "\U0010ffff"
+    suggestions = {
+        'titles': suggest_titles(low, high, limit),
+        'artists': suggest_artists(low, high, limit),
+    }
+
+    with _suggestions_lock:
+        if len(_suggestions) >= AUTOCOMPLETE_CACHE_SIZE:
+            _suggestions.clear()
+        _suggestions[(key, limit)] = (now + AUTOCOMPLETE_TTL, suggestions)
+    return suggestions
+
+def get_charts():
+    """
+    Lists the charts computed by charts.py, with genre names resolved.
+    """
+    genre_names = get_genre_names()
+    charts = []
+    for row in query("SELECT kind, scope, refreshed_at FROM charts ORDER BY kind, scope"):
+        chart = dict(row)
+        if chart['kind'] == 'genre':
+            chart['name'] = genre_names.get(chart['scope'])
+            if chart['name'] is None:
+                continue
+        charts.append(chart)
+    return charts
+
+def get_chart(kind, scope=0):
+    """
+    Fetches a chart and its ranked albums, or None if it does not exist.
+    """
+    rows = query("""
+        SELECT kind, scope, mean, prior_weight, refreshed_at
+        FROM charts
+        WHERE kind = ? AND scope = ?
+    """, (kind, scope))
+    if not rows:
+        return None
+    chart = dict(rows[0])
+    if kind == 'genre':
+        chart['name'] = get_genre_names().get(scope)
+    chart['entries'] = [dict(row) for row in query("""
+        SELECT c.position, c.score, c.review_count, c.avg_rating,
+               a.id, a.title, a.artist, a.year, a.image_url
+        FROM chart_entries c
+        JOIN albums a ON a.id = c.album_id
+        WHERE c.kind = ? AND c.scope = ?
+        ORDER BY c.position
+    """, (kind, scope))]
+    return chart
+
+SIMILAR_ALBUMS_SHOWN = 6
+
+def get_similar_albums(album_id, limit=SIMILAR_ALBUMS_SHOWN):
+    """
+    Fetches the albums listeners of this album also liked, as computed by
+    similar.py.
+    """
+    rows = query("""
+        SELECT a.id, a.title, a.artist, a.year, a.image_url
+        FROM similar_albums s
+        JOIN albums a ON a.id = s.similar_id
+        WHERE s.album_id = ?
+        ORDER BY s.score DESC, s.similar_id
+        LIMIT ?
+    """, (album_id, limit))
+    return [dict(row) for row in rows]
+
 def get_album_reviews(album_id):
     """
     Fetches all reviews for a specific album.
@@ -266,15 +1029,6 @@ def get_album_reviews(album_id):
     rows = query(sql, (album_id,))
     return [dict(row) for row in rows]
 
-def get_album_avg_rating(album_id):
-    """
-    Calculates the average rating for an album.
-    """
-    sql = "SELECT AVG(stars) as avg FROM reviews WHERE album_id = ?"
-    result = query(sql, (album_id,))
-    avg = result[0]['avg'] if result and result[0]['avg'] else None
-    return round(avg, 1) if avg else None
-
 def has_user_reviewed(album_id, user_id):
     """
     Checks if a user has already reviewed an album.
@@ -285,6 +1039,49 @@ def has_user_reviewed(album_id, user_id):
     result = query(sql, (album_id, user_id))
     return bool(result)
 
+FAVORITE_BATCH_LIMIT = 1000
+
+@writes.queued
+def toggle_favorite(user_id, album_id):
+    """
+    Flips whether the user has favorited the album and returns the new state,
+    or None if the album does not exist. Both statements run in one job on
+    the writer thread, so repeated clicks cannot interleave.
+    """
+    if query(
+        "DELETE FROM favorites WHERE user_id = ? AND album_id = ? RETURNING album_id",
+        (user_id, album_id)
+    ):
+        return False
+    inserted = query("""
+        INSERT INTO favorites (user_id, album_id)
+        SELECT ?, id FROM albums WHERE id = ?
+        RETURNING album_id
+    """, (user_id, album_id))
+    return True if inserted else None
+
+@writes.queued
+def apply_favorite_changes(user_id, changes):
+    """
+    Applies {album_id: favorite} changes for a user in one transaction and
+    returns the ids of every album the user has favorited afterwards.
+    Albums that do not exist are skipped.
+    """
+    with transaction():
+        execute_many("""
+            INSERT OR IGNORE INTO favorites (user_id, album_id)
+            SELECT ?, id FROM albums WHERE id = ?
+        """, [(user_id, album_id) for album_id, favorite in changes.items() if favorite])
+        execute_many(
+            "DELETE FROM favorites WHERE user_id = ? AND album_id = ?",
+            [(user_id, album_id) for album_id, favorite in changes.items() if not favorite]
+        )
+        rows = query(
+            "SELECT album_id FROM favorites WHERE user_id = ? ORDER BY album_id",
+            (user_id,)
+        )
+    return [row["album_id"] for row in rows]
+
 def get_user_profile(user_id):
     """
     Fetches user profile information.
@@ -300,6 +1097,7 @@ def get_user_profile(user_id):
     rows = query(sql, (user_id,))
     return dict(rows[0]) if rows else None
 
+@writes.queued
 def update_user_profile(user_id, bio, location, profile_image_url, favorite_genre_id):
     """
     Updates or creates a user profile.
@@ -317,29 +1115,3 @@ def update_user_profile(user_id, bio, location, profile_image_url, favorite_genr
             INSERT INTO user_profiles (user_id, bio, location, profile_image_url, favorite_genre_id)
             VALUES (?, ?, ?, ?, ?)
         """, (user_id, bio, location, profile_image_url, favorite_genre_id))
-
-def get_user_activity(user_id):
-    """
-    Fetches recent user activity.
-    """
-    recent_albums = query("""
-        SELECT id, title, artist
-        FROM albums
-        WHERE user_id = ?
-        ORDER BY id DESC
-        LIMIT 5
-    """, (user_id,))
-
-    recent_reviews = query("""
-        SELECT r.id, r.stars, r.text, r.created_at, a.title as album_title, a.id as album_id
-        FROM reviews r
-        JOIN albums a ON r.album_id = a.id
-        WHERE r.user_id = ?
-        ORDER BY r.created_at DESC
-        LIMIT 5
-    """, (user_id,))
-
-    return {
-        'recent_albums': [dict(row) for row in recent_albums],
-        'recent_reviews': [dict(row) for row in recent_reviews]
-    }
@@ -1,38 +1,194 @@
 """
 Database utility functions for executing queries and managing connections.
+
+Connections are pooled: each Flask request (or worker thread outside of a
+request) borrows one connection for its whole lifetime and hands it back
+when it ends, so the PRAGMA setup below only runs once per connection.
 """
 
+import queue
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, has_app_context
+import metrics
 
 DB_PATH = "database.db"
+POOL_SIZE = 8
+STATEMENT_CACHE_SIZE = 256
 
-def get_connection():
+PRAGMAS = (
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA cache_size = -65536",
+    "PRAGMA temp_store = MEMORY",
+)
+
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+_local = threading.local()
+
+def connect():
     """
-    Establishes and returns a database connection with foreign key support.
+    Opens and configures a new database connection.
+    The connection is in autocommit mode; use transaction() to group writes.
     """
-    con = sqlite3.connect(DB_PATH)
-    con.execute("PRAGMA foreign_keys = ON")
+    con = sqlite3.connect(
+        DB_PATH,
+        isolation_level=None,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE
+    )
     con.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        con.execute(pragma)
     return con
 
-def execute(sql, params=None):
+def acquire():
     """
-    Executes a SQL statement with optional parameters and commits the changes.
+    Takes an idle connection from the pool, or opens a new one.
+    """
+    try:
+        return _pool.get_nowait()
+    except queue.Empty:
+        return connect()
+
+def release(con):
+    """
+    Returns a connection to the pool, closing it if the pool is full.
+    """
+    if con.in_transaction:
+        con.rollback()
+    try:
+        _pool.put_nowait(con)
+    except queue.Full:
+        con.close()
+
+def close_pool():
+    """
+    Closes every idle pooled connection, e.g. after changing DB_PATH.
+    """
+    while True:
+        try:
+            _pool.get_nowait().close()
+        except queue.Empty:
+            break
+    con = getattr(_local, "con", None)
+    if con is not None:
+        _local.con = None
+        con.close()
+
+def get_connection():
+    """
+    Returns the connection bound to the current request or thread.
+    """
+    if has_app_context():
+        if "db" not in g:
+            g.db = acquire()
+        return g.db
+    con = getattr(_local, "con", None)
+    if con is None:
+        con = _local.con = acquire()
+    return con
+
+def close_connection(exception=None):
+    """
+    Hands the request's connection back to the pool.
+    """
+    con = g.pop("db", None)
+    if con is not None:
+        release(con)
+
+def init_app(app):
+    """
+    Registers the connection teardown handler on the Flask app.
+    """
+    app.teardown_appcontext(close_connection)
+
+@contextmanager
+def transaction():
+    """
+    Runs the enclosed statements in a single transaction that is committed
+    once on success and rolled back on error. Nested uses run in a savepoint
+    of the outer one, so an error only undoes the nested block.
     """
-    params = params or []
     con = get_connection()
-    cur = con.execute(sql, params)
+    if con.in_transaction:
+        con.execute("SAVEPOINT nested")
+        try:
+            yield con
+        except BaseException:
+            con.execute("ROLLBACK TO nested")
+            con.execute("RELEASE nested")
+            raise
+        con.execute("RELEASE nested")
+        return
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        yield con
+    except BaseException:
+        con.rollback()
+        raise
     con.commit()
-    last_id = cur.lastrowid
-    con.close()
-    return last_id
+
+def execute(sql, params=None):
+    """
+    Executes a SQL statement with optional parameters and commits the changes,
+    unless it runs inside transaction().
+    """
+    params = params or []
+    start = time.perf_counter()
+    cur = get_connection().execute(sql, params)
+    metrics.record_query(sql, params, time.perf_counter() - start)
+    return cur.lastrowid
+
+def execute_many(sql, seq_of_params):
+    """
+    Executes a SQL statement once for every parameter tuple.
+    """
+    start = time.perf_counter()
+    get_connection().executemany(sql, seq_of_params)
+    metrics.record_query(sql, None, time.perf_counter() - start)
 
 def query(sql, params=None):
     """
     Executes a SQL query with optional parameters and returns the results.
     """
     params = params or []
-    con = get_connection()
-    rows = con.execute(sql, params).fetchall()
-    con.close()
+    start = time.perf_counter()
+    rows = get_connection().execute(sql, params).fetchall()
+    metrics.record_query(sql, params, time.perf_counter() - start)
     return rows
+
+def columns(sql, params=None):
+    """
+    Returns the column names of a query's result without reading any rows.
+    """
+    params = params or []
+    start = time.perf_counter()
+    cur = get_connection().execute(f"SELECT * FROM ({sql}) LIMIT 0", params)
+    metrics.record_query(sql, params, time.perf_counter() - start)
+    return [description[0] for description in cur.description]
+
+def iterate(sql, params=None, size=1000):
+    """
+    Yields the rows of a query in batches of size without loading the whole
+    result. Runs on a dedicated connection, so a long export does not hold
+    on to a pooled one, and reads one consistent snapshot.
+    """
+    params = params or []
+    con = connect()
+    try:
+        start = time.perf_counter()
+        cur = con.execute(sql, params)
+        metrics.record_query(sql, params, time.perf_counter() - start)
+        while True:
+            rows = cur.fetchmany(size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        con.close()
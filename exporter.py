@@ -0,0 +1,124 @@
+"""
+Streaming export of collections, favorites, reviews and the full catalog.
+
+Rows are read in batches through db.iterate() and written out as CSV or
+NDJSON chunk by chunk, so memory use stays flat however large the export.
+Album exports use the same columns as importer.py, so they can be imported
+again.
+
+Usage:
+    python3 exporter.py albums --user alice > albums.csv
+    python3 exporter.py reviews --user alice --format ndjson > reviews.ndjson
+    python3 exporter.py catalog > catalog.csv
+"""
+
+import argparse
+import csv
+import io
+import json
+import sys
+import database
+from db import columns, iterate
+
+FORMATS = ("csv", "ndjson")
+MIMETYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+BATCH_SIZE = 1000
+
+ALBUM_SELECT = """
+    SELECT a.id, a.title, a.artist, a.year,
+           (SELECT group_concat(g.name, '; ')
+            FROM album_genres ag
+            JOIN genres g ON g.id = ag.genre_id
+            WHERE ag.album_id = a.id) AS genres,
+           a.image_url, a.review_count, ROUND(a.avg_rating, 2) AS avg_rating
+"""
+
+# Export name -> (SQL, whether it takes a user id).
+EXPORTS = {
+    "albums": (ALBUM_SELECT + """
+        FROM albums a
+        WHERE a.user_id = ?
+        ORDER BY a.id
+    """, True),
+    "favorites": (ALBUM_SELECT + """
+        FROM favorites f
+        JOIN albums a ON a.id = f.album_id
+        WHERE f.user_id = ?
+        ORDER BY f.album_id
+    """, True),
+    "reviews": ("""
+        SELECT r.id, r.album_id, a.title AS album_title, a.artist, r.stars, r.text,
+               r.created_at
+        FROM reviews r
+        JOIN albums a ON a.id = r.album_id
+        WHERE r.user_id = ?
+        ORDER BY r.id
+    """, True),
+    "catalog": (ALBUM_SELECT + """,
+           u.username AS owner
+        FROM albums a
+        JOIN users u ON u.id = a.user_id
+        ORDER BY a.id
+    """, False),
+}
+
+def export_params(name, user_id=None):
+    return (user_id,) if EXPORTS[name][1] else ()
+
+def export_rows(name, user_id=None):
+    """
+    Yields batches of rows for an export.
+    """
+    return iterate(EXPORTS[name][0], export_params(name, user_id), BATCH_SIZE)
+
+def generate_csv(header, batches):
+    """
+    Yields CSV text: the header row, then one chunk per batch. An empty
+    export is just the header.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    for rows in batches:
+        writer.writerows(tuple(row) for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+def generate_ndjson(batches):
+    """
+    Yields NDJSON text, one chunk per batch.
+    """
+    for rows in batches:
+        yield "".join(json.dumps(dict(row)) + "\n" for row in rows)
+
+def generate(name, file_format, user_id=None):
+    """
+    Yields an export in the given format as text chunks.
+    """
+    batches = export_rows(name, user_id)
+    if file_format == "csv":
+        return generate_csv(columns(EXPORTS[name][0], export_params(name, user_id)), batches)
+    return generate_ndjson(batches)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("export", choices=EXPORTS)
+    parser.add_argument("--user", help="username whose data is exported")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    args = parser.parse_args()
+
+    user_id = None
+    if EXPORTS[args.export][1]:
+        user_id = database.get_user_id(args.user) if args.user else None
+        if not user_id:
+            parser.error(f"{args.export} needs --user with an existing username")
+
+    for chunk in generate(args.export, args.format, user_id):
+        sys.stdout.write(chunk)
+
+if __name__ == "__main__":
+    main()
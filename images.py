@@ -0,0 +1,210 @@
+"""
+Local image uploads for album covers and profile pictures.
+
+Uploads are stored under UPLOAD_DIR named by the SHA-256 of their content,
+so identical files are kept once and a URL never changes meaning; that lets
+them be served with immutable cache headers. Fixed-size thumbnails for the
+album grids are generated by a background worker pool when Pillow is
+installed. Until a thumbnail exists, or without Pillow, pages fall back to
+the original image; each new thumbnail bumps the page cache generation so
+cached pages pick it up.
+"""
+
+import hashlib
+import io
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from flask import abort, send_from_directory
+import cache
+import writes
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # Pillow is optional
+    Image = None
+
+UPLOAD_DIR = "uploads"
+URL_PREFIX = "/images/"
+MAX_UPLOAD_BYTES = 5 * 1024 * 1024
+THUMBNAIL_SIZE = (300, 300)
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_WORKERS = 2
+CACHE_SECONDS = 365 * 24 * 60 * 60
+THUMBNAIL_URL_CACHE_SIZE = 10000
+
+# Leading bytes of the accepted image formats.
+SIGNATURES = (
+    (b"\xff\xd8\xff", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+)
+
+logger = logging.getLogger("vinylcabinet.images")
+
+_executor = None
+# Digest -> thumbnail URL for thumbnails known to exist. Thumbnails are
+# never replaced, so hits stay valid.
+_thumbnail_urls = {}
+
+class InvalidImage(ValueError):
+    """
+    Raised for uploads that are too large or not a supported image.
+    """
+
+def image_type(data):
+    """
+    Returns the file extension for image data, or None if unsupported.
+    """
+    for signature, extension in SIGNATURES:
+        if data.startswith(signature):
+            return extension
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+def originals_dir():
+    return os.path.abspath(os.path.join(UPLOAD_DIR, "originals"))
+
+def thumbnails_dir():
+    return os.path.abspath(os.path.join(UPLOAD_DIR, "thumbs"))
+
+def thumbnail_extension():
+    return "webp" if features.check("webp") else "jpg"
+
+def write_atomically(path, data):
+    """
+    Writes data to path through a temporary file, so readers never see a
+    partial file.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    handle, temporary = tempfile.mkstemp(dir=directory)
+    with os.fdopen(handle, "wb") as output:
+        output.write(data)
+    os.replace(temporary, path)
+
+def make_thumbnail(name):
+    """
+    Writes the grid thumbnail for a stored original, unless it exists.
+    Returns whether a thumbnail was written.
+    """
+    digest = name.rsplit(".", 1)[0]
+    extension = thumbnail_extension()
+    path = os.path.join(thumbnails_dir(), f"{digest}.{extension}")
+    if os.path.exists(path):
+        return False
+    with Image.open(os.path.join(originals_dir(), name)) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(THUMBNAIL_SIZE)
+        if image.mode not in ("RGB", "RGBA") or extension == "jpg":
+            image = image.convert("RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, "WEBP" if extension == "webp" else "JPEG",
+                   quality=THUMBNAIL_QUALITY)
+        write_atomically(path, buffer.getvalue())
+    return True
+
+def schedule_thumbnail(name):
+    """
+    Queues thumbnail generation on the background pool when Pillow is available.
+    """
+    global _executor  # pylint: disable=global-statement
+    if Image is None:
+        return
+    if _executor is None:
+        _executor = ThreadPoolExecutor(THUMBNAIL_WORKERS, thread_name_prefix="thumbnails")
+
+    def finish(future):
+        if future.exception() is not None:
+            logger.warning("thumbnail for %s failed: %s", name, future.exception())
+        elif future.result():
+            # Pages rendered meanwhile link the original; render them again.
+            writes.submit(cache.invalidate, "pages")
+
+    _executor.submit(make_thumbnail, name).add_done_callback(finish)
+
+def save_upload(upload):
+    """
+    Stores an uploaded file and returns its URL, or None if no file was sent.
+    Raises InvalidImage for oversized or unsupported files.
+    """
+    if not upload or not upload.filename:
+        return None
+    data = upload.stream.read(MAX_UPLOAD_BYTES + 1)
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise InvalidImage(f"Images must be at most {MAX_UPLOAD_BYTES // (1024 * 1024)} MB.")
+    extension = image_type(data)
+    if extension is None:
+        raise InvalidImage("Images must be JPEG, PNG, GIF or WebP files.")
+
+    name = f"{hashlib.sha256(data).hexdigest()}.{extension}"
+    path = os.path.join(originals_dir(), name)
+    if not os.path.exists(path):
+        write_atomically(path, data)
+    schedule_thumbnail(name)
+    return URL_PREFIX + name
+
+def thumbnail_url(url):
+    """
+    Template filter returning the thumbnail URL for an uploaded image, or the
+    URL itself for external images and images without a thumbnail yet.
+    """
+    if not url or not url.startswith(URL_PREFIX):
+        return url
+    digest = url[len(URL_PREFIX):].rsplit(".", 1)[0]
+    thumbnail = _thumbnail_urls.get(digest)
+    if thumbnail:
+        return thumbnail
+    for extension in ("webp", "jpg"):
+        if os.path.exists(os.path.join(thumbnails_dir(), f"{digest}.{extension}")):
+            if len(_thumbnail_urls) >= THUMBNAIL_URL_CACHE_SIZE:
+                _thumbnail_urls.clear()
+            thumbnail = _thumbnail_urls[digest] = f"{URL_PREFIX}thumbs/{digest}.{extension}"
+            return thumbnail
+    return url
+
+def serve(directory, name):
+    """
+    Sends a stored file with immutable cache headers, since names are
+    content hashes.
+    """
+    if "/" in name or name.startswith("."):
+        abort(404)
+    response = send_from_directory(directory, name, max_age=CACHE_SECONDS)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+def original_view(name):
+    return serve(originals_dir(), name)
+
+def thumbnail_view(name):
+    return serve(thumbnails_dir(), name)
+
+def generate_missing_thumbnails():
+    """
+    Creates thumbnails for every stored original that has none, e.g. after
+    installing Pillow.
+    """
+    if Image is None:
+        raise SystemExit("Pillow is not installed; thumbnails cannot be generated.")
+    if not os.path.isdir(originals_dir()):
+        return
+    extensions = {extension for _, extension in SIGNATURES} | {"webp"}
+    made = False
+    for name in sorted(os.listdir(originals_dir())):
+        if name.rsplit(".", 1)[-1] in extensions:
+            made = make_thumbnail(name) or made
+    if made:
+        cache.invalidate("pages")
+
+def init_app(app):
+    """
+    Registers the image routes and the thumbnail template filter.
+    """
+    app.add_url_rule(URL_PREFIX + "<name>", "image", original_view)
+    app.add_url_rule(URL_PREFIX + "thumbs/<name>", "thumbnail", thumbnail_view)
+    app.add_template_filter(thumbnail_url, "thumbnail")
@@ -0,0 +1,133 @@
+"""
+Streaming bulk import of album collections from CSV or NDJSON files.
+
+Rows are read one at a time, validated with database.validate_album_data
+and inserted in chunks of CHUNK_SIZE rows, one transaction per chunk, so
+memory use does not grow with the size of the file. Genres are given by
+name ("Rock; Jazz" in CSV, a list or the same string in NDJSON) and
+resolved through the cached genre map.
+
+Usage:
+    python3 importer.py --user alice collection.csv
+    python3 importer.py --user alice --format ndjson collection.ndjson
+"""
+
+import argparse
+import csv
+import io
+import json
+import sys
+import database
+import writes
+
+CHUNK_SIZE = 500
+FORMATS = ("csv", "ndjson")
+GENRE_SEPARATOR = ";"
+
+def detect_format(filename):
+    """
+    Guesses the import format from a file name, defaulting to CSV.
+    """
+    return "ndjson" if filename.lower().endswith((".ndjson", ".jsonl", ".json")) else "csv"
+
+def read_rows(stream, file_format):
+    """
+    Yields (line number, row) pairs from a text stream. Rows that cannot be
+    parsed are yielded as None.
+    """
+    if file_format == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+def parse_row(row, genre_ids):
+    """
+    Turns an imported row into album data and returns it with its
+    validation errors.
+    """
+    if row is None:
+        return None, {"row": "Row could not be parsed."}
+
+    genre_names = row.get("genres") or []
+    if isinstance(genre_names, str):
+        genre_names = genre_names.split(GENRE_SEPARATOR)
+    genre_names = [str(name).strip() for name in genre_names if str(name).strip()]
+
+    album = {
+        "title": str(row.get("title") or "").strip(),
+        "artist": str(row.get("artist") or "").strip(),
+        "year": str(row.get("year") or "").strip(),
+        "image_url": str(row.get("image_url") or "").strip(),
+        "genres": [genre_ids[name.lower()] for name in genre_names if name.lower() in genre_ids],
+    }
+    errors = database.validate_album_data(album)
+    unknown = [name for name in genre_names if name.lower() not in genre_ids]
+    if unknown:
+        errors["genres"] = f"Unknown genres: {', '.join(unknown)}."
+    return album, errors
+
+def import_albums(stream, file_format, user_id, chunk_size=CHUNK_SIZE):
+    """
+    Imports albums for a user from a text stream. Yields a progress dict
+    after every chunk_size rows with running totals and the errors of the
+    rows in that chunk; the last one has "done" set.
+    """
+    genre_ids = database.get_genre_ids_by_name()
+    totals = {"rows": 0, "imported": 0, "failed": 0}
+    albums = []
+    errors = []
+    for line_number, row in read_rows(stream, file_format):
+        totals["rows"] += 1
+        album, row_errors = parse_row(row, genre_ids)
+        if row_errors:
+            totals["failed"] += 1
+            errors.append({"line": line_number, "errors": row_errors})
+        else:
+            albums.append(album)
+        if totals["rows"] % chunk_size == 0:
+            if albums:
+                totals["imported"] += len(database.add_albums(user_id, albums))
+            yield dict(totals, errors=errors, done=False)
+            albums = []
+            errors = []
+    if albums:
+        totals["imported"] += len(database.add_albums(user_id, albums))
+    yield dict(totals, errors=errors, done=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("file", help="CSV or NDJSON file to import, or - for stdin")
+    parser.add_argument("--user", required=True, help="username that will own the albums")
+    parser.add_argument("--format", choices=FORMATS, help="file format (default: from the name)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    user_id = database.get_user_id(args.user)
+    if not user_id:
+        parser.error(f"unknown user: {args.user}")
+    file_format = args.format or detect_format(args.file)
+
+    if args.file == "-":
+        stream = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8-sig", newline="")
+    else:
+        # pylint: disable-next=consider-using-with
+        stream = open(args.file, encoding="utf-8-sig", newline="")
+    with stream:
+        for progress in import_albums(stream, file_format, user_id, args.chunk_size):
+            for error in progress["errors"]:
+                print(f"line {error['line']}: {error['errors']}", file=sys.stderr)
+            print(f"{progress['rows']} rows read, {progress['imported']} imported, "
+                  f"{progress['failed']} failed", file=sys.stderr)
+    writes.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Maintenance commands for upgrading the schema and rebuilding derived data.
+
+Usage:
+    python3 maintenance.py migrate
+    python3 maintenance.py rebuild-search
+    python3 maintenance.py backfill-ratings
+    python3 maintenance.py recount
+    python3 maintenance.py rebuild-user-stats
+    python3 maintenance.py rebuild-facets
+    python3 maintenance.py rebuild-similar
+    python3 maintenance.py rebuild-charts
+    python3 maintenance.py rebuild-name-keys
+    python3 maintenance.py backfill-artists
+    python3 maintenance.py rebuild-artist-counts
+    python3 maintenance.py thumbnails
+"""
+
+import argparse
+import charts
+import db
+import database
+import images
+import similar
+
+SCHEMA_PATH = "schema.sql"
+
+# Columns added after the first release, which CREATE TABLE IF NOT EXISTS
+# cannot add to an existing database.
+ADDED_COLUMNS = {
+    "albums": [
+        ("review_count", "INTEGER NOT NULL DEFAULT 0"),
+        ("rating_sum", "INTEGER NOT NULL DEFAULT 0"),
+        ("avg_rating", "REAL NOT NULL DEFAULT 0"),
+        ("release_year", "INTEGER GENERATED ALWAYS AS (CAST(year AS INTEGER)) VIRTUAL"),
+        ("title_key", "TEXT"),
+        ("artist_key", "TEXT"),
+        ("artist_id", "INTEGER REFERENCES artists (id)"),
+    ],
+    "cache_generations": [
+        ("changed_at", "DATETIME"),
+    ],
+}
+
+def migrate():
+    """
+    Adds missing columns to existing tables and applies schema.sql.
+    """
+    con = db.get_connection()
+    for table, columns in ADDED_COLUMNS.items():
+        existing = {row["name"] for row in con.execute(f"PRAGMA table_xinfo({table})")}
+        if not existing:
+            continue
+        for name, definition in columns:
+            if name not in existing:
+                con.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+    with open(SCHEMA_PATH, encoding="utf-8") as schema:
+        con.executescript(schema.read())
+
+COMMANDS = {
+    "migrate": (
+        migrate,
+        "Bring an existing database up to date with schema.sql."
+    ),
+    "rebuild-search": (
+        database.rebuild_search_index,
+        "Rebuild the full-text search index for albums."
+    ),
+    "backfill-ratings": (
+        database.backfill_album_ratings,
+        "Recompute review counts and average ratings on albums."
+    ),
+    "recount": (
+        database.rebuild_table_counts,
+        "Recompute the cached row counts used by album listings."
+    ),
+    "rebuild-user-stats": (
+        database.rebuild_user_stats,
+        "Recompute the per-user statistics shown on profile pages."
+    ),
+    "rebuild-facets": (
+        database.rebuild_album_facets,
+        "Recompute the genre and decade counts used by the album filters."
+    ),
+    "rebuild-similar": (
+        similar.refresh_all,
+        "Recompute every album's similar albums (needs NumPy and SciPy)."
+    ),
+    "rebuild-charts": (
+        charts.refresh,
+        "Recompute the Bayesian-ranked top charts."
+    ),
+    "rebuild-name-keys": (
+        database.rebuild_name_keys,
+        "Recompute the folded title and artist keys used by autocomplete."
+    ),
+    "backfill-artists": (
+        database.backfill_artists,
+        "Link albums without an artist to the artists table, adding artists as needed."
+    ),
+    "rebuild-artist-counts": (
+        database.rebuild_artist_counts,
+        "Recompute the album and review counts shown on artist pages."
+    ),
+    "thumbnails": (
+        images.generate_missing_thumbnails,
+        "Create missing thumbnails for uploaded images (needs Pillow)."
+    ),
+}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name, (_, help_text) in COMMANDS.items():
+        subparsers.add_parser(name, help=help_text)
+    args = parser.parse_args()
+
+    command, _ = COMMANDS[args.command]
+    command()
+    print(f"{args.command}: done")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Request and query instrumentation for the Vinyl Cabinet application.
+
+Every statement run through db.query/db.execute is timed and attributed to
+the current request. Per-route latency histograms and query totals are
+exposed in Prometheus text format on /metrics, slow statements are logged
+as structured JSON, and per-request totals can be sent as Server-Timing
+headers. Statements run on the writer thread are collected per job and
+recorded in the request that queued the job.
+"""
+
+import json
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context, request, abort, current_app
+
+SLOW_QUERY_SECONDS = 0.1
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+LOCAL_ADDRESSES = ("127.0.0.1", "::1")
+
+logger = logging.getLogger("vinylcabinet.queries")
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+_lock = threading.Lock()
+_routes = {}
+_collectors = []
+_collecting = threading.local()
+
+def normalize_sql(sql):
+    """
+    Collapses whitespace and replaces literals and IN lists with placeholders,
+    so statements that differ only in their values group together.
+    """
+    sql = _STRING_LITERAL.sub("?", sql)
+    sql = _NUMBER_LITERAL.sub("?", sql)
+    sql = _IN_LIST.sub("(?, ...)", sql)
+    return _WHITESPACE.sub(" ", sql).strip()
+
+def route_name():
+    return request.endpoint or "unmatched"
+
+def record_query(sql, params, elapsed):
+    """
+    Attributes a finished statement to the current request and logs it if slow.
+    """
+    timings = getattr(_collecting, "timings", None)
+    if timings is not None:
+        timings.append((sql, params, elapsed))
+        return
+    if has_request_context():
+        g.query_count = g.get("query_count", 0) + 1
+        g.db_time = g.get("db_time", 0.0) + elapsed
+        if elapsed > g.get("slowest_time", 0.0):
+            g.slowest_time = elapsed
+            g.slowest_sql = sql
+    if elapsed >= SLOW_QUERY_SECONDS:
+        logger.warning(json.dumps({
+            "event": "slow_query",
+            "route": route_name() if has_request_context() else None,
+            "duration_ms": round(elapsed * 1000, 2),
+            "sql": normalize_sql(sql),
+            "params": len(params or []),
+        }))
+
+@contextmanager
+def collect_queries():
+    """
+    Collects the timings of statements run on this thread as
+    (sql, params, elapsed) instead of recording them, so they can be
+    recorded later by the thread they were run for.
+    """
+    timings = []
+    _collecting.timings = timings
+    try:
+        yield timings
+    finally:
+        _collecting.timings = None
+
+def record_queries(timings):
+    for sql, params, elapsed in timings:
+        record_query(sql, params, elapsed)
+
+def start_request():
+    g.request_start = time.perf_counter()
+
+def finish_request(response):
+    """
+    Records the request in its route's histogram and adds Server-Timing.
+    """
+    elapsed = time.perf_counter() - g.request_start
+    query_count = g.get("query_count", 0)
+    db_time = g.get("db_time", 0.0)
+
+    with _lock:
+        stats = _routes.setdefault(route_name(), {
+            "buckets": [0] * len(LATENCY_BUCKETS),
+            "count": 0,
+            "sum": 0.0,
+            "queries": 0,
+            "db_seconds": 0.0,
+        })
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if elapsed <= bound:
+                stats["buckets"][index] += 1
+        stats["count"] += 1
+        stats["sum"] += elapsed
+        stats["queries"] += query_count
+        stats["db_seconds"] += db_time
+
+    logger.debug(json.dumps({
+        "event": "request",
+        "route": route_name(),
+        "duration_ms": round(elapsed * 1000, 2),
+        "queries": query_count,
+        "db_ms": round(db_time * 1000, 2),
+        "slowest_sql": normalize_sql(g.slowest_sql) if "slowest_sql" in g else None,
+    }))
+
+    if current_app.config["SERVER_TIMING"]:
+        response.headers["Server-Timing"] = (
+            f'db;dur={db_time * 1000:.2f};desc="{query_count} queries", '
+            f"total;dur={elapsed * 1000:.2f}"
+        )
+    return response
+
+def register_collector(collector):
+    """
+    Adds a function returning extra Prometheus text lines to /metrics.
+    """
+    _collectors.append(collector)
+
+def render_metrics():
+    """
+    Returns all collected metrics in the Prometheus text exposition format.
+    """
+    lines = [
+        "# HELP vinylcabinet_request_duration_seconds Request latency by route.",
+        "# TYPE vinylcabinet_request_duration_seconds histogram",
+    ]
+    with _lock:
+        routes = {name: dict(stats, buckets=list(stats["buckets"]))
+                  for name, stats in _routes.items()}
+    for name, stats in sorted(routes.items()):
+        for bound, count in zip(LATENCY_BUCKETS, stats["buckets"]):
+            lines.append(
+                f'vinylcabinet_request_duration_seconds_bucket{{route="{name}",le="{bound}"}} '
+                f"{count}"
+            )
+        lines.append(
+            f'vinylcabinet_request_duration_seconds_bucket{{route="{name}",le="+Inf"}} '
+            f"{stats['count']}"
+        )
+        lines.append(f'vinylcabinet_request_duration_seconds_sum{{route="{name}"}} '
+                     f"{stats['sum']:.6f}")
+        lines.append(f'vinylcabinet_request_duration_seconds_count{{route="{name}"}} '
+                     f"{stats['count']}")
+
+    lines.append("# HELP vinylcabinet_db_queries_total SQL statements run, by route.")
+    lines.append("# TYPE vinylcabinet_db_queries_total counter")
+    for name, stats in sorted(routes.items()):
+        lines.append(f'vinylcabinet_db_queries_total{{route="{name}"}} {stats["queries"]}')
+
+    lines.append("# HELP vinylcabinet_db_seconds_total Time spent in SQL statements, by route.")
+    lines.append("# TYPE vinylcabinet_db_seconds_total counter")
+    for name, stats in sorted(routes.items()):
+        lines.append(f'vinylcabinet_db_seconds_total{{route="{name}"}} '
+                     f"{stats['db_seconds']:.6f}")
+
+    for collector in _collectors:
+        lines.extend(collector())
+    return "\n".join(lines) + "\n"
+
+def metrics_view():
+    """
+    Serves /metrics to local clients only.
+    """
+    if request.remote_addr not in LOCAL_ADDRESSES:
+        abort(404)
+    return render_metrics(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+def init_app(app):
+    """
+    Registers the request hooks and the /metrics endpoint. Server-Timing
+    headers are added when the app's SERVER_TIMING setting is true.
+    """
+    app.config.setdefault("SERVER_TIMING", False)
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.add_url_rule("/metrics", "metrics", metrics_view)
@@ -0,0 +1,119 @@
+"""
+Conditional GET and rendered-page caching for anonymous visitors.
+
+Public pages are stamped with the 'pages' generation from cache_generations,
+which triggers bump on every write to albums, reviews, favorites, users and
+user profiles. Repeat visitors get 304 Not Modified while that generation
+is unchanged, and rendered HTML is kept in a size-capped LRU cache keyed
+by route and query arguments.
+"""
+
+import functools
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from flask import request, session, make_response
+from db import query
+
+MAX_BYTES = 32 * 1024 * 1024
+
+_lock = threading.Lock()
+_pages = OrderedDict()
+_stats = {"hits": 0, "misses": 0, "bytes": 0}
+
+def is_anonymous():
+    """
+    Only visitors without a login or pending flash messages get shared pages.
+    """
+    return "user_id" not in session and "_flashes" not in session
+
+def current_version():
+    """
+    Returns the pages generation and the time it last changed.
+    """
+    row = query("SELECT generation, changed_at FROM cache_generations WHERE name = 'pages'")
+    if not row:
+        return 0, None
+    changed_at = row[0]["changed_at"]
+    if changed_at:
+        changed_at = datetime.strptime(changed_at, "%Y-%m-%d %H:%M:%S").replace(
+            tzinfo=timezone.utc
+        )
+    return row[0]["generation"], changed_at
+
+def lookup(key, version):
+    with _lock:
+        entry = _pages.get(key)
+        if entry and entry[0] == version:
+            _pages.move_to_end(key)
+            _stats["hits"] += 1
+            return entry[1]
+        _stats["misses"] += 1
+        return None
+
+def store(key, version, body):
+    with _lock:
+        old = _pages.pop(key, None)
+        if old:
+            _stats["bytes"] -= len(old[1])
+        if len(body) > MAX_BYTES:
+            return
+        _pages[key] = (version, body)
+        _stats["bytes"] += len(body)
+        while _stats["bytes"] > MAX_BYTES:
+            _, (_, evicted) = _pages.popitem(last=False)
+            _stats["bytes"] -= len(evicted)
+
+def clear():
+    with _lock:
+        _pages.clear()
+        _stats["bytes"] = 0
+
+def cached_page(view):
+    """
+    Serves a GET view from the page cache for anonymous visitors and answers
+    conditional requests with 304 while the data version is unchanged.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != "GET" or not is_anonymous():
+            return view(*args, **kwargs)
+
+        version, changed_at = current_version()
+        key = (request.endpoint, request.path, tuple(sorted(request.args.items(multi=True))))
+        body = lookup(key, version)
+        if body is not None:
+            response = make_response(body)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or not is_anonymous():
+                return response
+            store(key, version, response.get_data())
+
+        response.set_etag(f"pages-{version}", weak=True)
+        if changed_at:
+            response.last_modified = changed_at
+        response.cache_control.no_cache = True
+        response.vary.add("Cookie")
+        return response.make_conditional(request)
+    return wrapper
+
+def render_metrics():
+    """
+    Returns the page cache counters as Prometheus text lines.
+    """
+    with _lock:
+        hits, misses, size = _stats["hits"], _stats["misses"], _stats["bytes"]
+        entries = len(_pages)
+    return [
+        "# HELP vinylcabinet_page_cache_requests_total Page cache lookups by result.",
+        "# TYPE vinylcabinet_page_cache_requests_total counter",
+        f'vinylcabinet_page_cache_requests_total{{result="hit"}} {hits}',
+        f'vinylcabinet_page_cache_requests_total{{result="miss"}} {misses}',
+        "# HELP vinylcabinet_page_cache_bytes Size of the cached pages.",
+        "# TYPE vinylcabinet_page_cache_bytes gauge",
+        f"vinylcabinet_page_cache_bytes {size}",
+        "# HELP vinylcabinet_page_cache_entries Number of cached pages.",
+        "# TYPE vinylcabinet_page_cache_entries gauge",
+        f"vinylcabinet_page_cache_entries {entries}",
+    ]
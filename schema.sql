@@ -12,9 +12,28 @@ CREATE TABLE IF NOT EXISTS albums (
     genre TEXT,
     user_id INTEGER NOT NULL,
     image_url TEXT,
+    review_count INTEGER NOT NULL DEFAULT 0,
+    rating_sum INTEGER NOT NULL DEFAULT 0,
+    avg_rating REAL NOT NULL DEFAULT 0,
+    release_year INTEGER GENERATED ALWAYS AS (CAST(year AS INTEGER)) VIRTUAL,
+    title_key TEXT,
+    artist_key TEXT,
+    artist_id INTEGER REFERENCES artists (id),
     FOREIGN KEY (user_id) REFERENCES users (id)
 );
 
+-- One row per distinct folded artist name (albums.artist_key); name is the
+-- spelling first seen. The counters are kept by triggers on albums, and an
+-- artist is deleted together with its last album.
+CREATE TABLE IF NOT EXISTS artists (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    name_key TEXT UNIQUE NOT NULL,
+    album_count INTEGER NOT NULL DEFAULT 0,
+    review_count INTEGER NOT NULL DEFAULT 0,
+    rating_sum INTEGER NOT NULL DEFAULT 0
+);
+
 CREATE TABLE IF NOT EXISTS favorites (
     user_id INTEGER NOT NULL,
     album_id INTEGER NOT NULL,
@@ -59,6 +78,83 @@ CREATE TABLE IF NOT EXISTS user_profiles (
     FOREIGN KEY (favorite_genre_id) REFERENCES genres (id)
 );
 
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id INTEGER PRIMARY KEY,
+    num_albums INTEGER NOT NULL DEFAULT 0,
+    reviews_received INTEGER NOT NULL DEFAULT 0,
+    rating_sum INTEGER NOT NULL DEFAULT 0,
+    reviews_written INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS table_counts (
+    name TEXT PRIMARY KEY,
+    total INTEGER NOT NULL
+);
+
+INSERT OR IGNORE INTO table_counts (name, total) SELECT 'albums', COUNT(*) FROM albums;
+
+-- Album counts per genre and decade for the facet sidebar; genre_id 0
+-- counts every album regardless of genre.
+CREATE TABLE IF NOT EXISTS album_facets (
+    genre_id INTEGER NOT NULL,
+    decade INTEGER NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (genre_id, decade)
+) WITHOUT ROWID;
+
+-- "Listeners also liked" lists written by similar.py: the TOP_K albums most
+-- often liked by the same users, scored by cosine similarity.
+CREATE TABLE IF NOT EXISTS similar_albums (
+    album_id INTEGER NOT NULL,
+    similar_id INTEGER NOT NULL,
+    score REAL NOT NULL,
+    PRIMARY KEY (album_id, similar_id),
+    FOREIGN KEY (album_id) REFERENCES albums (id) ON DELETE CASCADE,
+    FOREIGN KEY (similar_id) REFERENCES albums (id) ON DELETE CASCADE
+) WITHOUT ROWID;
+
+-- Albums whose reviews or favorites changed since similar.py last ran, one
+-- row per album; an incremental run recomputes only these and deletes the
+-- rows it handled. A new change moves the album's row to a new id, so a
+-- change during a run is kept for the next one.
+CREATE TABLE IF NOT EXISTS similar_albums_changes (
+    id INTEGER PRIMARY KEY,
+    album_id INTEGER NOT NULL
+);
+
+-- Ranked charts written by charts.py. kind is 'all', 'trending', 'genre' or
+-- 'decade'; scope is the genre id or first year of the decade, otherwise 0.
+CREATE TABLE IF NOT EXISTS charts (
+    kind TEXT NOT NULL,
+    scope INTEGER NOT NULL,
+    mean REAL NOT NULL,
+    prior_weight REAL NOT NULL,
+    refreshed_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (kind, scope)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS chart_entries (
+    kind TEXT NOT NULL,
+    scope INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    album_id INTEGER NOT NULL,
+    score REAL NOT NULL,
+    review_count INTEGER NOT NULL,
+    avg_rating REAL NOT NULL,
+    PRIMARY KEY (kind, scope, position),
+    FOREIGN KEY (album_id) REFERENCES albums (id) ON DELETE CASCADE
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS cache_generations (
+    name TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL,
+    changed_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT OR IGNORE INTO cache_generations (name, generation)
+VALUES ('genres', 0), ('users', 0), ('pages', 0);
+
 INSERT OR IGNORE INTO genres (name) VALUES
     ('Rock'), ('Pop'), ('Jazz'), ('Hip-Hop'), ('Classical'), ('Electronic'), ('Metal');
 
@@ -66,11 +162,369 @@ CREATE INDEX IF NOT EXISTS idx_albums_user_id ON albums(user_id);
 CREATE INDEX IF NOT EXISTS idx_albums_title ON albums(title);
 CREATE INDEX IF NOT EXISTS idx_albums_artist ON albums(artist);
 CREATE INDEX IF NOT EXISTS idx_albums_year ON albums(year);
+CREATE INDEX IF NOT EXISTS idx_albums_avg_rating ON albums(avg_rating DESC, id DESC);
 CREATE INDEX IF NOT EXISTS idx_reviews_album_id ON reviews(album_id);
 CREATE INDEX IF NOT EXISTS idx_reviews_user_id ON reviews(user_id);
 CREATE INDEX IF NOT EXISTS idx_reviews_stars ON reviews(stars);
+CREATE INDEX IF NOT EXISTS idx_reviews_created_at ON reviews(created_at, album_id, stars);
 CREATE INDEX IF NOT EXISTS idx_favorites_user_id ON favorites(user_id);
 CREATE INDEX IF NOT EXISTS idx_favorites_album_id ON favorites(album_id);
 CREATE INDEX IF NOT EXISTS idx_album_genres_album_id ON album_genres(album_id);
-CREATE INDEX IF NOT EXISTS idx_album_genres_genre_id ON album_genres(genre_id);
-CREATE INDEX IF NOT EXISTS idx_user_profiles_favorite_genre ON user_profiles(favorite_genre_id);
\ No newline at end of file
+DROP INDEX IF EXISTS idx_album_genres_genre_id;
+CREATE INDEX IF NOT EXISTS idx_album_genres_genre_album ON album_genres(genre_id, album_id);
+CREATE INDEX IF NOT EXISTS idx_albums_release_year ON albums(release_year, id);
+CREATE INDEX IF NOT EXISTS idx_user_profiles_favorite_genre ON user_profiles(favorite_genre_id);
+CREATE INDEX IF NOT EXISTS idx_albums_title_key ON albums(title_key);
+DROP INDEX IF EXISTS idx_albums_artist_key;
+DROP INDEX IF EXISTS idx_albums_popularity;
+CREATE INDEX IF NOT EXISTS idx_albums_title_popularity ON albums(review_count DESC, id, title_key);
+CREATE INDEX IF NOT EXISTS idx_albums_artist_id ON albums(artist_id, year, id);
+CREATE INDEX IF NOT EXISTS idx_artists_popularity ON artists(review_count DESC, id, name_key);
+CREATE INDEX IF NOT EXISTS idx_similar_albums_similar_id ON similar_albums(similar_id);
+-- Logs written before changes were kept one row per album.
+DELETE FROM similar_albums_changes
+WHERE id NOT IN (SELECT MAX(id) FROM similar_albums_changes GROUP BY album_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_similar_albums_changes_album_id
+    ON similar_albums_changes(album_id);
+CREATE INDEX IF NOT EXISTS idx_chart_entries_album_id ON chart_entries(album_id);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS albums_fts USING fts5(
+    title, artist, genres, year,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+
+INSERT INTO albums_fts (albums_fts, rank) VALUES ('rank', 'bm25(10.0, 5.0, 2.0, 1.0)');
+
+CREATE TRIGGER IF NOT EXISTS albums_fts_insert AFTER INSERT ON albums BEGIN
+    INSERT INTO albums_fts (rowid, title, artist, genres, year)
+    VALUES (NEW.id, NEW.title, NEW.artist, '', NEW.year);
+END;
+
+CREATE TRIGGER IF NOT EXISTS albums_fts_update AFTER UPDATE OF title, artist, year ON albums BEGIN
+    UPDATE albums_fts SET title = NEW.title, artist = NEW.artist, year = NEW.year
+    WHERE rowid = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS albums_fts_delete AFTER DELETE ON albums BEGIN
+    DELETE FROM albums_fts WHERE rowid = OLD.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS album_genres_fts_insert AFTER INSERT ON album_genres BEGIN
+    UPDATE albums_fts SET genres = (
+        SELECT group_concat(g.name, ' ')
+        FROM album_genres ag
+        JOIN genres g ON ag.genre_id = g.id
+        WHERE ag.album_id = NEW.album_id
+    ) WHERE rowid = NEW.album_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS album_genres_fts_delete AFTER DELETE ON album_genres BEGIN
+    UPDATE albums_fts SET genres = (
+        SELECT group_concat(g.name, ' ')
+        FROM album_genres ag
+        JOIN genres g ON ag.genre_id = g.id
+        WHERE ag.album_id = OLD.album_id
+    ) WHERE rowid = OLD.album_id;
+END;
+
+
+CREATE TRIGGER IF NOT EXISTS reviews_rating_insert AFTER INSERT ON reviews BEGIN
+    UPDATE albums
+    SET review_count = review_count + 1,
+        rating_sum = rating_sum + NEW.stars,
+        avg_rating = (rating_sum + NEW.stars) * 1.0 / (review_count + 1)
+    WHERE id = NEW.album_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS reviews_rating_delete AFTER DELETE ON reviews BEGIN
+    UPDATE albums
+    SET review_count = review_count - 1,
+        rating_sum = rating_sum - OLD.stars,
+        avg_rating = CASE WHEN review_count > 1
+                          THEN (rating_sum - OLD.stars) * 1.0 / (review_count - 1)
+                          ELSE 0 END
+    WHERE id = OLD.album_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS reviews_rating_update AFTER UPDATE OF stars, album_id ON reviews BEGIN
+    UPDATE albums
+    SET review_count = review_count - 1,
+        rating_sum = rating_sum - OLD.stars,
+        avg_rating = CASE WHEN review_count > 1
+                          THEN (rating_sum - OLD.stars) * 1.0 / (review_count - 1)
+                          ELSE 0 END
+    WHERE id = OLD.album_id;
+    UPDATE albums
+    SET review_count = review_count + 1,
+        rating_sum = rating_sum + NEW.stars,
+        avg_rating = (rating_sum + NEW.stars) * 1.0 / (review_count + 1)
+    WHERE id = NEW.album_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS albums_count_insert AFTER INSERT ON albums BEGIN
+    UPDATE table_counts SET total = total + 1 WHERE name = 'albums';
+END;
+
+CREATE TRIGGER IF NOT EXISTS albums_count_delete AFTER DELETE ON albums BEGIN
+    UPDATE table_counts SET total = total - 1 WHERE name = 'albums';
+END;
+
+CREATE TRIGGER IF NOT EXISTS genres_cache_insert AFTER INSERT ON genres BEGIN
+    UPDATE cache_generations SET generation = generation + 1 WHERE name = 'genres';
+END;
+
+CREATE TRIGGER IF NOT EXISTS genres_cache_update AFTER UPDATE ON genres BEGIN
+    UPDATE cache_generations SET generation = generation + 1 WHERE name = 'genres';
+END;
+
+CREATE TRIGGER IF NOT EXISTS genres_cache_delete AFTER DELETE ON genres BEGIN
+    UPDATE cache_generations SET generation = generation + 1 WHERE name = 'genres';
+END;
+
+CREATE TRIGGER IF NOT EXISTS users_cache_update AFTER UPDATE OF username ON users BEGIN
+    UPDATE cache_generations SET generation = generation + 1 WHERE name = 'users';
+END;
+
+CREATE TRIGGER IF NOT EXISTS users_cache_delete AFTER DELETE ON users BEGIN
+    UPDATE cache_generations SET generation = generation + 1 WHERE name = 'users';
+END;
+
+CREATE TRIGGER IF NOT EXISTS albums_pages_insert AFTER INSERT ON albums BEGIN
+    UPDATE cache_generations SET generation = generation + 1, changed_at = CURRENT_TIMESTAMP
+    WHERE name = 'pages';
+END;
+
+CREATE TRIGGER IF NOT EXISTS albums_pages_update AFTER UPDATE ON albums BEGIN
+    UPDATE cache_generations SET generation = generation + 1, changed_at = CURRENT_TIMESTAMP
+    WHERE name = 'pages';
+END;
+
+CREATE TRIGGER IF NOT EXISTS albums_pages_delete AFTER DELETE ON albums BEGIN
+    UPDATE cache_generations SET generation = generation + 1, changed_at = CURRENT_TIMESTAMP
+    WHERE name = 'pages';
+END;
+
+CREATE TRIGGER IF NOT EXISTS reviews_pages_insert AFTER INSERT ON reviews BEGIN
+    UPDATE cache_generations SET generation = generation + 1, changed_at = CURRENT_TIMESTAMP
+    WHERE name = 'pages';
+END;
+
+CREATE TRIGGER IF NOT EXISTS reviews_pages_update AFTER UPDATE ON reviews BEGIN
+    UPDATE cache_generations SET generation = generation + 1, changed_at = CURRENT_TIMESTAMP
+    WHERE name = 'pages';
+END;
+
+CREATE TRIGGER IF NOT EXISTS reviews_pages_delete AFTER DELETE ON reviews BEGIN
+    UPDATE cache_generations SET generation = generation + 1, changed_at = CURRENT_TIMESTAMP
+    WHERE name = 'pages';
+END;
+
+CREATE TRIGGER IF NOT EXISTS favorites_pages_insert AFTER INSERT ON favorites BEGIN
+    UPDATE cache_generations SET generation = generation + 1, changed_at = CURRENT_TIMESTAMP
+    WHERE name = 'pages';
+END;
+
+CREATE TRIGGER IF NOT EXISTS favorites_pages_delete AFTER DELETE ON favorites BEGIN
+    UPDATE cache_generations SET generation = generation + 1, changed_at = CURRENT_TIMESTAMP
+    WHERE name = 'pages';
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_profiles_pages_insert AFTER INSERT ON user_profiles BEGIN
+    UPDATE cache_generations SET generation = generation + 1, changed_at = CURRENT_TIMESTAMP
+    WHERE name = 'pages';
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_profiles_pages_update AFTER UPDATE ON user_profiles BEGIN
+    UPDATE cache_generations SET generation = generation + 1, changed_at = CURRENT_TIMESTAMP
+    WHERE name = 'pages';
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_profiles_pages_delete AFTER DELETE ON user_profiles BEGIN
+    UPDATE cache_generations SET generation = generation + 1, changed_at = CURRENT_TIMESTAMP
+    WHERE name = 'pages';
+END;
+
+CREATE TRIGGER IF NOT EXISTS users_pages_insert AFTER INSERT ON users BEGIN
+    UPDATE cache_generations SET generation = generation + 1, changed_at = CURRENT_TIMESTAMP
+    WHERE name = 'pages';
+END;
+
+CREATE TRIGGER IF NOT EXISTS users_pages_delete AFTER DELETE ON users BEGIN
+    UPDATE cache_generations SET generation = generation + 1, changed_at = CURRENT_TIMESTAMP
+    WHERE name = 'pages';
+END;
+
+CREATE TRIGGER IF NOT EXISTS users_stats_insert AFTER INSERT ON users BEGIN
+    INSERT OR IGNORE INTO user_stats (user_id) VALUES (NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS albums_stats_insert AFTER INSERT ON albums BEGIN
+    UPDATE user_stats SET num_albums = num_albums + 1 WHERE user_id = NEW.user_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS albums_stats_delete AFTER DELETE ON albums BEGIN
+    UPDATE user_stats
+    SET num_albums = num_albums - 1,
+        reviews_received = reviews_received - OLD.review_count,
+        rating_sum = rating_sum - OLD.rating_sum
+    WHERE user_id = OLD.user_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS albums_stats_owner AFTER UPDATE OF user_id ON albums BEGIN
+    UPDATE user_stats
+    SET num_albums = num_albums - 1,
+        reviews_received = reviews_received - OLD.review_count,
+        rating_sum = rating_sum - OLD.rating_sum
+    WHERE user_id = OLD.user_id;
+    UPDATE user_stats
+    SET num_albums = num_albums + 1,
+        reviews_received = reviews_received + NEW.review_count,
+        rating_sum = rating_sum + NEW.rating_sum
+    WHERE user_id = NEW.user_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS reviews_stats_insert AFTER INSERT ON reviews BEGIN
+    UPDATE user_stats SET reviews_written = reviews_written + 1 WHERE user_id = NEW.user_id;
+    UPDATE user_stats
+    SET reviews_received = reviews_received + 1, rating_sum = rating_sum + NEW.stars
+    WHERE user_id = (SELECT user_id FROM albums WHERE id = NEW.album_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS reviews_stats_delete AFTER DELETE ON reviews BEGIN
+    UPDATE user_stats SET reviews_written = reviews_written - 1 WHERE user_id = OLD.user_id;
+    UPDATE user_stats
+    SET reviews_received = reviews_received - 1, rating_sum = rating_sum - OLD.stars
+    WHERE user_id = (SELECT user_id FROM albums WHERE id = OLD.album_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS reviews_stats_update AFTER UPDATE OF stars, album_id ON reviews BEGIN
+    UPDATE user_stats
+    SET reviews_received = reviews_received - 1, rating_sum = rating_sum - OLD.stars
+    WHERE user_id = (SELECT user_id FROM albums WHERE id = OLD.album_id);
+    UPDATE user_stats
+    SET reviews_received = reviews_received + 1, rating_sum = rating_sum + NEW.stars
+    WHERE user_id = (SELECT user_id FROM albums WHERE id = NEW.album_id);
+END;
+
+-- Facet counts. Deleting an album removes its genre rows by cascade after the
+-- album row is gone, so the album's own delete trigger runs BEFORE DELETE and
+-- subtracts it from every genre; the album_genres trigger then finds no album.
+CREATE TRIGGER IF NOT EXISTS albums_facets_insert AFTER INSERT ON albums BEGIN
+    INSERT INTO album_facets (genre_id, decade, total)
+    VALUES (0, IFNULL(NEW.release_year, 0) / 10 * 10, 1)
+    ON CONFLICT (genre_id, decade) DO UPDATE SET total = total + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS albums_facets_delete BEFORE DELETE ON albums BEGIN
+    UPDATE album_facets
+    SET total = total - 1
+    WHERE decade = IFNULL(OLD.release_year, 0) / 10 * 10
+      AND (genre_id = 0
+           OR genre_id IN (SELECT genre_id FROM album_genres WHERE album_id = OLD.id));
+END;
+
+CREATE TRIGGER IF NOT EXISTS albums_facets_year AFTER UPDATE OF year ON albums
+WHEN IFNULL(OLD.release_year, 0) / 10 IS NOT IFNULL(NEW.release_year, 0) / 10 BEGIN
+    UPDATE album_facets
+    SET total = total - 1
+    WHERE decade = IFNULL(OLD.release_year, 0) / 10 * 10
+      AND (genre_id = 0
+           OR genre_id IN (SELECT genre_id FROM album_genres WHERE album_id = NEW.id));
+    INSERT INTO album_facets (genre_id, decade, total)
+    SELECT 0, IFNULL(NEW.release_year, 0) / 10 * 10, 1
+    UNION ALL
+    SELECT genre_id, IFNULL(NEW.release_year, 0) / 10 * 10, 1
+    FROM album_genres
+    WHERE album_id = NEW.id
+    ON CONFLICT (genre_id, decade) DO UPDATE SET total = total + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS album_genres_facets_insert AFTER INSERT ON album_genres BEGIN
+    INSERT INTO album_facets (genre_id, decade, total)
+    SELECT NEW.genre_id, IFNULL(release_year, 0) / 10 * 10, 1
+    FROM albums
+    WHERE id = NEW.album_id
+    ON CONFLICT (genre_id, decade) DO UPDATE SET total = total + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS album_genres_facets_delete AFTER DELETE ON album_genres BEGIN
+    UPDATE album_facets
+    SET total = total - 1
+    WHERE genre_id = OLD.genre_id
+      AND decade = (SELECT IFNULL(release_year, 0) / 10 * 10 FROM albums WHERE id = OLD.album_id);
+END;
+
+-- Change log for incremental similar-albums refreshes.
+DROP TRIGGER IF EXISTS reviews_similar_insert;
+DROP TRIGGER IF EXISTS reviews_similar_delete;
+DROP TRIGGER IF EXISTS reviews_similar_update;
+DROP TRIGGER IF EXISTS favorites_similar_insert;
+DROP TRIGGER IF EXISTS favorites_similar_delete;
+
+CREATE TRIGGER IF NOT EXISTS reviews_similar_log_insert AFTER INSERT ON reviews BEGIN
+    INSERT INTO similar_albums_changes (album_id) VALUES (NEW.album_id)
+    ON CONFLICT (album_id) DO UPDATE SET id = (SELECT MAX(id) + 1 FROM similar_albums_changes);
+END;
+
+CREATE TRIGGER IF NOT EXISTS reviews_similar_log_delete AFTER DELETE ON reviews BEGIN
+    INSERT INTO similar_albums_changes (album_id) VALUES (OLD.album_id)
+    ON CONFLICT (album_id) DO UPDATE SET id = (SELECT MAX(id) + 1 FROM similar_albums_changes);
+END;
+
+CREATE TRIGGER IF NOT EXISTS reviews_similar_log_update AFTER UPDATE OF stars, album_id ON reviews
+BEGIN
+    INSERT INTO similar_albums_changes (album_id) VALUES (OLD.album_id), (NEW.album_id)
+    ON CONFLICT (album_id) DO UPDATE SET id = (SELECT MAX(id) + 1 FROM similar_albums_changes);
+END;
+
+CREATE TRIGGER IF NOT EXISTS favorites_similar_log_insert AFTER INSERT ON favorites BEGIN
+    INSERT INTO similar_albums_changes (album_id) VALUES (NEW.album_id)
+    ON CONFLICT (album_id) DO UPDATE SET id = (SELECT MAX(id) + 1 FROM similar_albums_changes);
+END;
+
+CREATE TRIGGER IF NOT EXISTS favorites_similar_log_delete AFTER DELETE ON favorites BEGIN
+    INSERT INTO similar_albums_changes (album_id) VALUES (OLD.album_id)
+    ON CONFLICT (album_id) DO UPDATE SET id = (SELECT MAX(id) + 1 FROM similar_albums_changes);
+END;
+
+-- Artist counters. Review totals reach artists through the album rating
+-- triggers' updates of albums.review_count and albums.rating_sum.
+CREATE TRIGGER IF NOT EXISTS albums_artists_insert AFTER INSERT ON albums BEGIN
+    UPDATE artists
+    SET album_count = album_count + 1,
+        review_count = review_count + NEW.review_count,
+        rating_sum = rating_sum + NEW.rating_sum
+    WHERE id = NEW.artist_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS albums_artists_delete AFTER DELETE ON albums BEGIN
+    UPDATE artists
+    SET album_count = album_count - 1,
+        review_count = review_count - OLD.review_count,
+        rating_sum = rating_sum - OLD.rating_sum
+    WHERE id = OLD.artist_id;
+    DELETE FROM artists WHERE id = OLD.artist_id AND album_count = 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS albums_artists_move AFTER UPDATE OF artist_id ON albums
+WHEN OLD.artist_id IS NOT NEW.artist_id BEGIN
+    UPDATE artists
+    SET album_count = album_count + 1,
+        review_count = review_count + NEW.review_count,
+        rating_sum = rating_sum + NEW.rating_sum
+    WHERE id = NEW.artist_id;
+    UPDATE artists
+    SET album_count = album_count - 1,
+        review_count = review_count - OLD.review_count,
+        rating_sum = rating_sum - OLD.rating_sum
+    WHERE id = OLD.artist_id;
+    DELETE FROM artists WHERE id = OLD.artist_id AND album_count = 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS albums_artists_rating AFTER UPDATE OF review_count, rating_sum ON albums
+WHEN OLD.artist_id IS NEW.artist_id BEGIN
+    UPDATE artists
+    SET review_count = review_count + NEW.review_count - OLD.review_count,
+        rating_sum = rating_sum + NEW.rating_sum - OLD.rating_sum
+    WHERE id = NEW.artist_id;
+END;
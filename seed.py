@@ -1,88 +1,238 @@
 """
 Script to seed the database with test data for users, albums, and reviews.
+
+Rows are generated in batches and inserted with executemany while indexes
+and triggers are dropped; schema.sql recreates them afterwards and the
+derived data (search index, ratings, counters, artists) is rebuilt in bulk.
+
+Usage:
+    python3 seed.py [--users N] [--albums N] [--reviews N] [--seed N] ...
 """
 
+import argparse
 import random
-import sqlite3
-
-db = sqlite3.connect("database.db")
-db.execute("PRAGMA foreign_keys = ON")
-db.execute("DELETE FROM reviews")
-db.execute("DELETE FROM favorites")
-db.execute("DELETE FROM album_genres")
-db.execute("DELETE FROM user_profiles")
-db.execute("DELETE FROM albums")
-db.execute("DELETE FROM users")
-
-USER_COUNT = 100000
-ALBUM_COUNT = 1000000
-REVIEW_COUNT = 5000000
-
-for i in range(1, USER_COUNT + 1):
-    db.execute("INSERT INTO users (username, password_hash) VALUES (?, ?)",
-               (f"user{i}", "hashedpassword"))
-
-
-genres = db.execute("SELECT id FROM genres").fetchall()
-genre_ids = [g[0] for g in genres]
-
-for i in range(1, ALBUM_COUNT + 1):
-    album_id = db.execute("""
-        INSERT INTO albums (title, artist, year, genre, user_id, image_url)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """, (
-        f"Album {i}",
-        f"Artist {random.randint(1, 50)}",
-        str(random.randint(1960, 2025)),
-        "",
-        random.randint(1, USER_COUNT),
-        None
-    )).lastrowid
-
-    num_genres = random.randint(1, 3)
-    selected_genres = random.sample(genre_ids, min(num_genres, len(genre_ids)))
-    for genre_id in selected_genres:
-        db.execute(
-            "INSERT INTO album_genres (album_id, genre_id) VALUES (?, ?)",
-            (album_id, genre_id)
-        )
+import time
+from datetime import date, datetime, timedelta
+import cache
+import charts
+import db
+import database
+import maintenance
 
-used_pairs = set()
-for _ in range(REVIEW_COUNT):
-    while True:
-        user_id = random.randint(1, USER_COUNT)
-        album_id = random.randint(1, ALBUM_COUNT)
-        pair = (album_id, user_id)
-        if pair not in used_pairs:
-            used_pairs.add(pair)
-            stars = random.randint(1, 5)
-            db.execute(
-                "INSERT INTO reviews (album_id, user_id, stars, text) VALUES (?, ?, ?, ?)",
-                (album_id, user_id, stars, f"Review for album {album_id} by user {user_id}")
-            )
-            break
-
-for i in range(1, USER_COUNT + 1):
-    if random.random() < 0.3:
-        db.execute("""
-            INSERT INTO user_profiles (user_id, bio, location, favorite_genre_id)
-            VALUES (?, ?, ?, ?)
-        """, (
+TABLES = (
+    "similar_albums", "similar_albums_changes", "chart_entries", "charts",
+    "reviews", "favorites", "album_genres", "user_profiles", "albums", "artists", "users",
+)
+
+LOAD_PRAGMAS = (
+    "PRAGMA foreign_keys = OFF",
+    "PRAGMA journal_mode = MEMORY",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA cache_size = -262144",
+)
+
+RESTORE_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = ON",
+)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Seed the database with test data.")
+    parser.add_argument("--database", default=db.DB_PATH, help="database file to seed")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--albums", type=int, default=1000000)
+    parser.add_argument("--reviews", type=int, default=5000000)
+    parser.add_argument("--favorites", type=int, default=500)
+    parser.add_argument("--artists", type=int, default=50)
+    parser.add_argument("--profile-ratio", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=None, help="RNG seed for reproducible data")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    return parser.parse_args()
+
+def batched(rows, batch_size):
+    """
+    Groups an iterable of rows into lists of at most batch_size rows.
+    """
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def load(con, table, sql, rows, batch_size):
+    """
+    Inserts generated rows in one transaction and reports the insert rate.
+    """
+    start = time.perf_counter()
+    count = 0
+    con.execute("BEGIN")
+    for batch in batched(rows, batch_size):
+        con.executemany(sql, batch)
+        count += len(batch)
+    con.commit()
+    report(table, count, time.perf_counter() - start)
+    return count
+
+def report(step, count, elapsed):
+    rate = count / elapsed if elapsed else 0
+    print(f"{step:<16} {count:>10} rows {elapsed:8.1f} s {rate:>12,.0f} rows/s")
+
+def generate_users(count):
+    for i in range(1, count + 1):
+        yield (i, f"user{i}", "hashedpassword")
+
+def generate_artists(count):
+    for i in range(1, count + 1):
+        name = f"Artist {i}"
+        yield (i, name, database.name_key(name))
+
+def generate_albums(rng, count, user_count, artist_count):
+    for i in range(1, count + 1):
+        title = f"Album {i}"
+        artist_id = rng.randint(1, artist_count)
+        artist = f"Artist {artist_id}"
+        yield (
             i,
-            f"This is user {i}'s bio",
-            random.choice(["Helsinki", "Tampere", "Turku", "Oulu", None]),
-            random.choice(genre_ids) if random.random() < 0.5 else None
-        ))
-
-for _ in range(500):
-    try:
-        db.execute(
-            "INSERT INTO favorites (user_id, album_id) VALUES (?, ?)",
-            (random.randint(1, USER_COUNT), random.randint(1, ALBUM_COUNT))
+            title,
+            artist,
+            str(rng.randint(1960, 2025)),
+            "",
+            rng.randint(1, user_count),
+            None,
+            database.name_key(title),
+            database.name_key(artist),
+            artist_id
         )
-    except sqlite3.IntegrityError:
-        pass
 
-db.commit()
-db.close()
-print("Test data added successfully!")
+def generate_album_genres(rng, album_count, genre_ids):
+    for album_id in range(1, album_count + 1):
+        for genre_id in rng.sample(genre_ids, min(rng.randint(1, 3), len(genre_ids))):
+            yield (album_id, genre_id)
+
+def generate_reviews(rng, count, album_count, user_count):
+    """
+    Yields unique (album, user) reviews without remembering past pairs:
+    each album draws its own reviewers with sampling without replacement.
+    """
+    today = datetime.combine(date.today(), datetime.min.time())
+    remaining = count
+    for album_id in range(1, album_count + 1):
+        albums_left = album_count - album_id + 1
+        if albums_left == 1:
+            num_reviews = remaining
+        else:
+            num_reviews = rng.randint(0, int(2 * remaining / albums_left))
+        num_reviews = min(num_reviews, remaining, user_count)
+        remaining -= num_reviews
+        for user_id in rng.sample(range(1, user_count + 1), num_reviews):
+            created_at = today - timedelta(seconds=rng.randint(0, 365 * 24 * 3600))
+            yield (
+                album_id,
+                user_id,
+                rng.randint(1, 5),
+                f"Review for album {album_id} by user {user_id}",
+                created_at.strftime("%Y-%m-%d %H:%M:%S")
+            )
+
+def generate_profiles(rng, user_count, ratio, genre_ids):
+    for i in range(1, user_count + 1):
+        if rng.random() < ratio:
+            yield (
+                i,
+                f"This is user {i}'s bio",
+                rng.choice(["Helsinki", "Tampere", "Turku", "Oulu", None]),
+                rng.choice(genre_ids) if rng.random() < 0.5 else None
+            )
+
+def generate_favorites(rng, count, album_count, user_count):
+    for _ in range(count):
+        yield (rng.randint(1, user_count), rng.randint(1, album_count))
+
+def drop_indexes_and_triggers(con):
+    """
+    Drops the secondary indexes and triggers defined in schema.sql so rows
+    load without per-row index and trigger maintenance.
+    """
+    rows = con.execute("""
+        SELECT type, name FROM sqlite_master
+        WHERE (type = 'index' AND name LIKE 'idx_%') OR type = 'trigger'
+    """).fetchall()
+    for row in rows:
+        con.execute(f"DROP {row['type'].upper()} IF EXISTS {row['name']}")
+
+def rebuild(step, function):
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    print(f"{step:<16} {'':>10}      {elapsed:8.1f} s")
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+    db.DB_PATH = args.database
+    con = db.get_connection()
+    maintenance.migrate()
+
+    for pragma in LOAD_PRAGMAS:
+        con.execute(pragma)
+    drop_indexes_and_triggers(con)
+    for table in TABLES:
+        con.execute(f"DELETE FROM {table}")
+    con.execute("DELETE FROM albums_fts")
+    con.execute(
+        "DELETE FROM sqlite_sequence WHERE name IN ('users', 'artists', 'albums', 'reviews')"
+    )
+
+    genre_ids = [row["id"] for row in con.execute("SELECT id FROM genres")]
+    batch_size = args.batch_size
+    total_start = time.perf_counter()
+
+    load(con, "users",
+         "INSERT INTO users (id, username, password_hash) VALUES (?, ?, ?)",
+         generate_users(args.users), batch_size)
+    load(con, "artists",
+         "INSERT INTO artists (id, name, name_key) VALUES (?, ?, ?)",
+         generate_artists(args.artists), batch_size)
+    load(con, "albums",
+         "INSERT INTO albums (id, title, artist, year, genre, user_id, image_url, "
+         "title_key, artist_key, artist_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+         generate_albums(rng, args.albums, args.users, args.artists), batch_size)
+    load(con, "album_genres",
+         "INSERT INTO album_genres (album_id, genre_id) VALUES (?, ?)",
+         generate_album_genres(rng, args.albums, genre_ids), batch_size)
+    load(con, "reviews",
+         "INSERT INTO reviews (album_id, user_id, stars, text, created_at) "
+         "VALUES (?, ?, ?, ?, ?)",
+         generate_reviews(rng, args.reviews, args.albums, args.users), batch_size)
+    load(con, "user_profiles",
+         "INSERT INTO user_profiles (user_id, bio, location, favorite_genre_id) "
+         "VALUES (?, ?, ?, ?)",
+         generate_profiles(rng, args.users, args.profile_ratio, genre_ids), batch_size)
+    load(con, "favorites",
+         "INSERT OR IGNORE INTO favorites (user_id, album_id) VALUES (?, ?)",
+         generate_favorites(rng, args.favorites, args.albums, args.users), batch_size)
+
+    rebuild("indexes", maintenance.migrate)
+    rebuild("search index", database.rebuild_search_index)
+    rebuild("ratings", database.backfill_album_ratings)
+    rebuild("artists", database.rebuild_artist_counts)
+    rebuild("counters", database.rebuild_table_counts)
+    rebuild("user stats", database.rebuild_user_stats)
+    rebuild("facets", database.rebuild_album_facets)
+    rebuild("charts", charts.refresh)
+    rebuild("analyze", lambda: con.execute("ANALYZE"))
+    cache.invalidate("users")
+    cache.invalidate("genres")
+    cache.invalidate("pages")
+
+    for pragma in RESTORE_PRAGMAS:
+        con.execute(pragma)
+    db.close_pool()
+    print(f"Test data added successfully in {time.perf_counter() - total_start:.1f} s!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+"""
+Offline job computing the "listeners also liked" lists in similar_albums.
+
+A user likes an album if they favorited it or reviewed it with at least
+LIKE_MIN_STARS stars. The likes are streamed into a sparse album-by-user
+matrix, and each album's TOP_K most similar albums (cosine similarity of
+their sets of fans, shared by at least MIN_COMMON_USERS users) are computed
+in chunks across a process pool. Results are staged in temporary tables and
+swapped in with one short transaction, so the app keeps serving the old
+lists while the job runs.
+
+Triggers log every album whose reviews or favorites change in
+similar_albums_changes, once per album however often it changes, so the log
+never outgrows the albums table even if the job stops running. By default
+only those albums are recomputed, from the likes of their own users; their
+new scores are also merged into the lists that contain them. Neighbours'
+lists can still drift slowly, so run a full refresh now and then. The first
+run is always a full one.
+
+Needs NumPy and SciPy; the app itself only reads similar_albums.
+
+Usage:
+    python3 similar.py
+    python3 similar.py --full [--workers N] [--chunk-size N]
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import cache
+import db
+from db import query, execute, execute_many, iterate, transaction
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # NumPy and SciPy are optional
+    np = None
+
+TOP_K = 10
+LIKE_MIN_STARS = 4
+MIN_COMMON_USERS = 2
+CHUNK_SIZE = 1000
+BATCH_SIZE = 100000
+
+LIKES_SQL = """
+    SELECT album_id, user_id FROM reviews WHERE stars >= :min_stars
+    UNION ALL
+    SELECT album_id, user_id FROM favorites
+"""
+
+_matrix = None
+_fans = None
+
+def load_likes(shape, snapshot=None):
+    """
+    Builds the binary album-by-user likes matrix. With a changes snapshot,
+    only the likes of users who like a changed album are loaded, which is
+    all that the similarities of those albums need.
+    """
+    sql = f"WITH likes AS ({LIKES_SQL}) SELECT album_id, user_id FROM likes"
+    params = {"min_stars": LIKE_MIN_STARS}
+    if snapshot is not None:
+        sql += """
+            WHERE user_id IN (
+                SELECT user_id FROM likes
+                WHERE album_id IN (
+                    SELECT album_id FROM similar_albums_changes WHERE id <= :snapshot
+                )
+            )
+        """
+        params["snapshot"] = snapshot
+    album_ids, user_ids = [], []
+    for rows in iterate(sql, params, BATCH_SIZE):
+        batch = np.array(rows, dtype=np.int64).reshape(-1, 2)
+        # Rows added after the shape was read don't fit; the next run sees them.
+        batch = batch[(batch[:, 0] < shape[0]) & (batch[:, 1] < shape[1])]
+        album_ids.append(batch[:, 0])
+        user_ids.append(batch[:, 1])
+    album_ids = np.concatenate(album_ids) if album_ids else np.zeros(0, dtype=np.int64)
+    user_ids = np.concatenate(user_ids) if user_ids else np.zeros(0, dtype=np.int64)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(album_ids), dtype=np.float32), (album_ids, user_ids)), shape=shape
+    )
+    # A favorite plus a liked review counts once.
+    matrix.data[:] = 1
+    return matrix
+
+def count_fans(size, album_ids):
+    """
+    Returns the number of users liking each of album_ids, indexed by album
+    id. Only albums in the refreshed matrix are counted, through their
+    album_id indexes, so the cost follows the matrix rather than all likes.
+    """
+    fans = np.zeros(size, dtype=np.float32)
+    execute("CREATE TEMP TABLE similar_fan_albums (album_id INTEGER PRIMARY KEY)")
+    try:
+        execute_many(
+            "INSERT INTO similar_fan_albums (album_id) VALUES (?)",
+            [(int(album_id),) for album_id in album_ids]
+        )
+        rows = query("""
+            SELECT album_id, COUNT(DISTINCT user_id) AS fans
+            FROM (
+                SELECT album_id, user_id FROM reviews
+                WHERE album_id IN (SELECT album_id FROM temp.similar_fan_albums)
+                  AND stars >= :min_stars
+                UNION ALL
+                SELECT album_id, user_id FROM favorites
+                WHERE album_id IN (SELECT album_id FROM temp.similar_fan_albums)
+            )
+            GROUP BY album_id
+        """, {"min_stars": LIKE_MIN_STARS})
+    finally:
+        execute("DROP TABLE IF EXISTS temp.similar_fan_albums")
+    for row in rows:
+        if row["album_id"] < size:
+            fans[row["album_id"]] = row["fans"]
+    return fans
+
+def init_worker(matrix, fans):
+    global _matrix, _fans  # pylint: disable=global-statement
+    _matrix = matrix
+    _fans = fans
+
+def similar_for(chunk):
+    """
+    Computes the similar albums of a chunk of (album id, watched ids) pairs.
+    Returns (album id, [(similar id, score)], {watched id: score or None})
+    for each album, where the watched ids are albums whose lists contain it.
+    """
+    album_ids = np.array([album_id for album_id, _ in chunk], dtype=np.int64)
+    common = (_matrix[album_ids] @ _matrix.T).tocsr()
+    results = []
+    for index, (album_id, watched) in enumerate(chunk):
+        start, end = common.indptr[index], common.indptr[index + 1]
+        ids = common.indices[start:end]
+        counts = common.data[start:end]
+        keep = (counts >= MIN_COMMON_USERS) & (ids != album_id)
+        ids, counts = ids[keep], counts[keep]
+        # Fan counts are read apart from the likes and can lag them; cap at 1.
+        scores = counts / np.sqrt(np.maximum(_fans[album_id] * _fans[ids], counts * counts))
+        if len(ids) > TOP_K:
+            top = np.argpartition(-scores, TOP_K)[:TOP_K]
+        else:
+            top = np.arange(len(ids))
+        similar = [(int(ids[i]), float(scores[i])) for i in top]
+        by_id = dict(zip(ids.tolist(), scores.tolist())) if watched else {}
+        results.append((album_id, similar, {other: by_id.get(other) for other in watched}))
+    return results
+
+def compute(matrix, fans, targets, workers, chunk_size):
+    """
+    Yields the results of similar_for() for every target, chunk by chunk,
+    using a process pool unless workers is 1.
+    """
+    chunks = [targets[start:start + chunk_size] for start in range(0, len(targets), chunk_size)]
+    if workers == 1:
+        init_worker(matrix, fans)
+        yield from map(similar_for, chunks)
+        return
+    with ProcessPoolExecutor(workers, initializer=init_worker,
+                             initargs=(matrix, fans)) as executor:
+        yield from executor.map(similar_for, chunks)
+
+def stage(results):
+    """
+    Writes the computed lists and watched scores to temporary tables.
+    """
+    execute("CREATE TEMP TABLE similar_next (album_id INTEGER, similar_id INTEGER, score REAL)")
+    execute("CREATE TEMP TABLE similar_watched (album_id INTEGER, similar_id INTEGER, score REAL)")
+    execute("CREATE TEMP TABLE similar_targets (album_id INTEGER PRIMARY KEY)")
+    for chunk in results:
+        execute_many(
+            "INSERT INTO similar_targets (album_id) VALUES (?)",
+            [(album_id,) for album_id, _, _ in chunk]
+        )
+        execute_many(
+            "INSERT INTO similar_next (album_id, similar_id, score) VALUES (?, ?, ?)",
+            [(album_id, other, score)
+             for album_id, similar, _ in chunk for other, score in similar]
+        )
+        execute_many(
+            "INSERT INTO similar_watched (album_id, similar_id, score) VALUES (?, ?, ?)",
+            [(other, album_id, score)
+             for album_id, _, watched in chunk for other, score in watched.items()]
+        )
+
+def apply(full, snapshot):
+    """
+    Replaces the lists of the recomputed albums with the staged ones. In
+    incremental runs the new scores are also merged into the other albums'
+    lists, which are then cut back to TOP_K entries.
+    """
+    with transaction():
+        if full:
+            execute("DELETE FROM similar_albums")
+        else:
+            execute("""
+                DELETE FROM similar_albums
+                WHERE album_id IN (SELECT album_id FROM temp.similar_targets)
+            """)
+        # Albums deleted while the job ran are skipped.
+        execute("""
+            INSERT INTO similar_albums (album_id, similar_id, score)
+            SELECT album_id, similar_id, score
+            FROM temp.similar_next
+            WHERE album_id IN (SELECT id FROM albums)
+              AND similar_id IN (SELECT id FROM albums)
+        """)
+        if not full:
+            execute("""
+                UPDATE similar_albums
+                SET score = w.score
+                FROM temp.similar_watched w
+                WHERE similar_albums.album_id = w.album_id
+                  AND similar_albums.similar_id = w.similar_id
+                  AND w.score IS NOT NULL
+            """)
+            execute("""
+                DELETE FROM similar_albums
+                WHERE (album_id, similar_id) IN (
+                    SELECT album_id, similar_id FROM temp.similar_watched WHERE score IS NULL
+                )
+            """)
+            execute("""
+                INSERT INTO similar_albums (album_id, similar_id, score)
+                SELECT similar_id, album_id, score
+                FROM temp.similar_next
+                WHERE similar_id NOT IN (SELECT album_id FROM temp.similar_targets)
+                  AND album_id IN (SELECT id FROM albums)
+                  AND similar_id IN (SELECT id FROM albums)
+                ON CONFLICT (album_id, similar_id) DO UPDATE SET score = excluded.score
+            """)
+            execute("""
+                DELETE FROM similar_albums
+                WHERE (album_id, similar_id) IN (
+                    SELECT album_id, similar_id FROM (
+                        SELECT album_id, similar_id,
+                               ROW_NUMBER() OVER (
+                                   PARTITION BY album_id ORDER BY score DESC, similar_id
+                               ) AS position
+                        FROM similar_albums
+                        WHERE album_id IN (SELECT similar_id FROM temp.similar_next)
+                    )
+                    WHERE position > ?
+                )
+            """, (TOP_K,))
+        execute("DELETE FROM similar_albums_changes WHERE id <= ?", (snapshot,))
+        cache.invalidate("pages")
+
+def refresh(full=False, workers=None, chunk_size=CHUNK_SIZE):
+    """
+    Recomputes the similar albums of the changed albums, or of every album
+    when full is set or no lists exist yet. Returns the number of albums
+    recomputed.
+    """
+    if np is None:
+        raise SystemExit("NumPy and SciPy are not installed; similar albums cannot be computed.")
+    snapshot = query("SELECT IFNULL(MAX(id), 0) AS id FROM similar_albums_changes")[0]["id"]
+    full = full or not query("SELECT 1 FROM similar_albums LIMIT 1")
+    if not full and not snapshot:
+        return 0
+
+    sizes = query("""
+        SELECT (SELECT IFNULL(MAX(id), 0) FROM albums) + 1 AS albums,
+               (SELECT IFNULL(MAX(id), 0) FROM users) + 1 AS users
+    """)[0]
+    shape = (sizes["albums"], sizes["users"])
+    if full:
+        matrix = load_likes(shape)
+        fans = np.diff(matrix.indptr).astype(np.float32)
+        targets = [(int(album_id), ()) for album_id in np.flatnonzero(fans)]
+    else:
+        matrix = load_likes(shape, snapshot)
+        fans = count_fans(shape[0], np.flatnonzero(np.diff(matrix.indptr)))
+        watched = {}
+        for row in query("""
+            SELECT s.similar_id, s.album_id
+            FROM similar_albums s
+            WHERE s.similar_id IN (SELECT album_id FROM similar_albums_changes WHERE id <= ?)
+        """, (snapshot,)):
+            watched.setdefault(row["similar_id"], []).append(row["album_id"])
+        targets = [
+            (row["album_id"], watched.get(row["album_id"], ()))
+            for row in query("""
+                SELECT DISTINCT c.album_id
+                FROM similar_albums_changes c
+                JOIN albums a ON a.id = c.album_id
+                WHERE c.id <= ? AND c.album_id < ?
+                ORDER BY c.album_id
+            """, (snapshot, shape[0]))
+        ]
+        # A watched album that is itself recomputed gets a fresh list anyway.
+        changed = {album_id for album_id, _ in targets}
+        targets = [(album_id, [other for other in others if other not in changed])
+                   for album_id, others in targets]
+
+    try:
+        stage(compute(matrix, fans, targets, workers or os.cpu_count() or 1, chunk_size))
+        apply(full, snapshot)
+    finally:
+        for table in ("similar_next", "similar_watched", "similar_targets"):
+            execute(f"DROP TABLE IF EXISTS temp.{table}")
+    return len(targets)
+
+def refresh_all():
+    """
+    Recomputes the similar albums of every album.
+    """
+    refresh(full=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--full", action="store_true", help="recompute every album")
+    parser.add_argument("--workers", type=int, help="worker processes (default: CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="albums per worker task")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    count = refresh(args.full, args.workers, args.chunk_size)
+    db.close_pool()
+    print(f"similar albums: {count} albums recomputed in {time.perf_counter() - start:.1f} s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+// Fills the search box's datalist with suggestions from /api/autocomplete.
+(function () {
+  var input = document.querySelector("input[data-autocomplete]");
+  if (!input) {
+    return;
+  }
+  var list = document.getElementById(input.getAttribute("list"));
+  var timer = null;
+  var latest = "";
+
+  function show(data) {
+    if (data.query !== latest) {
+      return;
+    }
+    list.replaceChildren();
+    data.titles.concat(data.artists).forEach(function (suggestion) {
+      var option = document.createElement("option");
+      option.value = suggestion.title || suggestion.artist;
+      if (suggestion.title) {
+        option.label = suggestion.title + " – " + suggestion.artist;
+      }
+      list.appendChild(option);
+    });
+  }
+
+  input.addEventListener("input", function () {
+    clearTimeout(timer);
+    latest = input.value;
+    if (!latest.trim()) {
+      list.replaceChildren();
+      return;
+    }
+    timer = setTimeout(function () {
+      fetch(input.dataset.autocomplete + "?q=" + encodeURIComponent(latest))
+        .then(function (response) { return response.json(); })
+        .then(show)
+        .catch(function () {});
+    }, 150);
+  });
+})();
@@ -0,0 +1,107 @@
+"""
+Regression test: listing pages issue a fixed number of queries however many
+albums they show.
+
+Run from the repository root with:
+    python3 -m unittest discover tests
+"""
+
+import os
+import re
+import sqlite3
+import tempfile
+import unittest
+import cache
+import database
+import db
+import pagecache
+from app import app
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_TIMING = re.compile(r'desc="(\d+) queries"')
+
+class ListingQueryCountTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        db.close_pool()
+        self.saved_path = db.DB_PATH
+        db.DB_PATH = os.path.join(self.directory.name, "database.db")
+        with open(os.path.join(ROOT, "schema.sql"), encoding="utf-8") as schema:
+            con = sqlite3.connect(db.DB_PATH)
+            con.executescript(schema.read())
+        con.execute("INSERT INTO users (username, password_hash) VALUES ('alice', 'x')")
+        con.execute("INSERT INTO users (username, password_hash) VALUES ('bob', 'x')")
+        con.commit()
+        con.close()
+        self.album_count = 0
+        # Generations are read at most once per interval; read them every time.
+        self.saved_interval = cache.CHECK_INTERVAL
+        cache.CHECK_INTERVAL = 0
+        app.config["SERVER_TIMING"] = True
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config["SERVER_TIMING"] = False
+        cache.CHECK_INTERVAL = self.saved_interval
+        pagecache.clear()
+        db.close_pool()
+        db.DB_PATH = self.saved_path
+        self.directory.cleanup()
+
+    def add_albums(self, count):
+        """
+        Adds albums with genres, a review and a favorite each.
+        """
+        con = sqlite3.connect(db.DB_PATH)
+        for _ in range(count):
+            self.album_count += 1
+            number = self.album_count
+            album_id = con.execute(
+                "INSERT INTO albums (title, artist, year, genre, user_id) VALUES (?, ?, ?, '', 1)",
+                (f"Album {number}", f"Artist {number % 3}", str(1960 + number))
+            ).lastrowid
+            con.execute("INSERT INTO album_genres (album_id, genre_id) VALUES (?, 1), (?, 2)",
+                        (album_id, album_id))
+            con.execute(
+                "INSERT INTO reviews (album_id, user_id, stars, text) VALUES (?, 2, 4, 'ok')",
+                (album_id,)
+            )
+            con.execute("INSERT INTO favorites (user_id, album_id) VALUES (1, ?)", (album_id,))
+        con.commit()
+        con.close()
+
+    def query_count(self, url):
+        """
+        Renders url without the page and search count caches and returns its
+        statement count.
+        """
+        pagecache.clear()
+        database._search_counts.clear()  # pylint: disable=protected-access
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return int(SERVER_TIMING.search(response.headers["Server-Timing"]).group(1))
+
+    def query_counts(self, urls):
+        # The first requests fill the genre and username caches.
+        for url in urls:
+            self.query_count(url)
+        return {url: self.query_count(url) for url in urls}
+
+    def assert_constant(self, urls):
+        self.add_albums(3)
+        few = self.query_counts(urls)
+        self.add_albums(30)
+        many = self.query_counts(urls)
+        self.assertEqual(few, many)
+
+    def test_anonymous_listings(self):
+        self.assert_constant(["/", "/?sort=title", "/?query=album", "/user/alice"])
+
+    def test_logged_in_listings(self):
+        with self.client.session_transaction() as session:
+            session["user_id"] = 1
+            session["username"] = "alice"
+        self.assert_constant(["/", "/?sort=title", "/?query=album", "/user/alice"])
+
+if __name__ == "__main__":
+    unittest.main()
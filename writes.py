@@ -0,0 +1,157 @@
+"""
+Single-writer queue for database mutations.
+
+SQLite allows one writer at a time, so request threads that commit on their
+own connections queue up on the write lock and can fail with "database is
+locked". Instead, every mutation is handed to one writer thread that runs
+whatever is waiting in a single transaction (group commit). Each job runs
+in its own savepoint, so its caller still gets back its own result, such as
+a lastrowid, or its own exception without affecting the rest of the batch.
+The job's statement timings travel back with it and are recorded in the
+caller's request, so writes still show up in its metrics.
+"""
+
+import functools
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+import db
+import metrics
+
+MAX_BATCH = 64
+MAX_RETRIES = 5
+RETRY_DELAY = 0.05
+
+_queue = queue.Queue()
+_lock = threading.Lock()
+_thread = None
+
+def is_busy(error):
+    """
+    Tells whether an error means another connection holds the write lock.
+    """
+    message = str(error)
+    return isinstance(error, sqlite3.OperationalError) and (
+        "database is locked" in message or "database is busy" in message
+    )
+
+def run_batch(batch):
+    """
+    Runs a batch of jobs in one transaction and returns their outcomes as
+    (result, exception, statement timings) triples. Lock timeouts are
+    retried with backoff.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        con = db.get_connection()
+        outcomes = []
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            for _, func, args, kwargs in batch:
+                with metrics.collect_queries() as timings:
+                    try:
+                        with db.transaction():
+                            outcomes.append((func(*args, **kwargs), None, timings))
+                    except Exception as error:  # pylint: disable=broad-exception-caught
+                        if is_busy(error) or not con.in_transaction:
+                            raise
+                        outcomes.append((None, error, timings))
+            con.commit()
+            return outcomes
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            if con.in_transaction:
+                con.rollback()
+            if not is_busy(error) or attempt == MAX_RETRIES:
+                return [(None, error, [])] * len(batch)
+            time.sleep(RETRY_DELAY * 2 ** attempt)
+    return []
+
+def writer_loop():
+    """
+    Takes waiting jobs off the queue in batches until stop() is called.
+    """
+    running = True
+    while running:
+        batch = [_queue.get()]
+        while len(batch) < MAX_BATCH:
+            try:
+                batch.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+        if None in batch:
+            running = False
+            batch = [job for job in batch if job is not None]
+        if not batch:
+            continue
+        for (future, _, _, _), (result, error, timings) in zip(batch, run_batch(batch)):
+            future.query_timings = timings
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+    db.close_pool()
+
+def start():
+    """
+    Starts the writer thread unless it is already running.
+    """
+    global _thread  # pylint: disable=global-statement
+    with _lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=writer_loop, name="db-writer", daemon=True)
+            _thread.start()
+
+def stop():
+    """
+    Finishes the queued jobs, stops the writer thread and closes its connection.
+    """
+    global _thread  # pylint: disable=global-statement
+    with _lock:
+        thread = _thread
+    if thread is not None and thread.is_alive():
+        _queue.put(None)
+        thread.join()
+    with _lock:
+        if _thread is thread:
+            _thread = None
+
+def submit(func, *args, **kwargs):
+    """
+    Queues func(*args, **kwargs) for the writer thread and returns a Future.
+    Once done, its query_timings attribute lists the job's statements for
+    metrics.record_queries().
+    """
+    start()
+    future = Future()
+    _queue.put((future, func, args, kwargs))
+    return future
+
+def run(func, *args, **kwargs):
+    """
+    Runs func(*args, **kwargs) on the writer thread and waits for its result,
+    recording the job's statements in the calling request's metrics. Calls
+    made from the writer thread itself run directly.
+    """
+    if threading.current_thread() is _thread:
+        return func(*args, **kwargs)
+    future = submit(func, *args, **kwargs)
+    try:
+        return future.result()
+    finally:
+        metrics.record_queries(getattr(future, "query_timings", ()))
+
+def queued(func):
+    """
+    Decorates a function so that it always runs on the writer thread.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return run(func, *args, **kwargs)
+    return wrapper
+
+def execute(sql, params=None):
+    """
+    Executes one write statement on the writer thread and returns its lastrowid.
+    """
+    return run(db.execute, sql, params)